@@ -4,11 +4,17 @@ import sqlite3  # Or your specific DB connector (psycopg2 for PostgreSQL, etc.)
 from pathlib import Path  # To potentially show resume filenames if needed
 from dotenv import load_dotenv
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from export_service import EXPORT_FORMATS, EXPORT_TABLES, export_table, get_table_columns, parse_filter
+from candidate_search import search_candidates
+from match_explanations import bits_to_skills, load_vocabulary
 
 # --- Configuration ---
 load_dotenv()
 
 DB_PATH = os.getenv("DB_NAME")
+SEARCH_RESULT_LIMIT = 25
 
 
 @st.cache_resource
@@ -79,6 +85,92 @@ def load_candidate_details(email):
     return None
 
 
+@st.cache_data
+def load_match_explanations(job_id):
+    """Loads score, reason and matched/missing/extra skills of every shortlisted candidate for a job."""
+    conn = get_db_connection()
+    if conn:
+        try:
+            cursor = conn.cursor()
+            vocabulary = load_vocabulary(cursor)
+            query = """
+                SELECT c.email_id, m.match_score, m.reason, e.skill_coverage,
+                       e.matched_skills, e.missing_skills, e.extra_skills, e.missing_count
+                FROM match_explanations e
+                JOIN match_scores m ON m.job_id = e.job_id AND m.candidate_id = e.candidate_id
+                JOIN candidates c ON c.candidate_id = e.candidate_id
+                WHERE e.job_id = ?
+                ORDER BY m.match_score DESC
+            """
+            cursor.execute(query, (job_id,))
+            rows = [
+                {
+                    "email_id": (row["email_id"] or "").strip(),
+                    "match_score": row["match_score"],
+                    "reason": row["reason"],
+                    "skill_coverage": row["skill_coverage"],
+                    "matched": bits_to_skills(row["matched_skills"], vocabulary),
+                    "missing": bits_to_skills(row["missing_skills"], vocabulary),
+                    "extra": bits_to_skills(row["extra_skills"], vocabulary),
+                    "missing_count": row["missing_count"],
+                }
+                for row in cursor.fetchall()
+            ]
+            return pd.DataFrame(rows)
+        except sqlite3.OperationalError:
+            # Databases matched before explanations existed have no match_explanations table yet.
+            return pd.DataFrame()
+        except Exception as e:
+            st.error(f"Error loading match explanations for {job_id}: {e}")
+    return pd.DataFrame()
+
+
+@st.cache_data
+def search_resumes(query):
+    """BM25-ranked keyword search over resumes, best match first."""
+    conn = get_db_connection()
+    if conn:
+        try:
+            return pd.DataFrame(search_candidates(conn.cursor(), query, limit=SEARCH_RESULT_LIMIT))
+        except Exception as e:
+            st.error(f"Error searching resumes for {query!r}: {e}")
+    return pd.DataFrame()
+
+
+@st.cache_resource
+def get_export_executor():
+    """Background workers for exports, shared across sessions so a long export never blocks the UI."""
+    return ThreadPoolExecutor(max_workers=2)
+
+
+@st.cache_resource
+def get_export_jobs():
+    """Export job id -> status dict, updated by the worker thread while the export runs."""
+    return {}
+
+
+def start_export(table, export_format, columns, filters):
+    jobs = get_export_jobs()
+    job_id = f"#{len(jobs) + 1} {table}.{export_format} ({time.strftime('%H:%M:%S')})"
+    job = {"table": table, "format": export_format, "rows": 0, "status": "running", "path": None, "error": None}
+    jobs[job_id] = job
+
+    def progress(rows):
+        job["rows"] = rows
+
+    def run():
+        try:
+            job["path"] = export_table(
+                table, export_format, columns=columns or None, filters=filters, progress_callback=progress
+            )
+            job["status"] = "done"
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+
+    get_export_executor().submit(run)
+
+
 # --- Streamlit App Layout ---
 
 st.set_page_config(
@@ -146,6 +238,17 @@ if not job_listings_df.empty:
                     f"Found {len(candidate_emails)} potential matches for this role."
                 )
 
+                explanations_df = load_match_explanations(selected_job_id)
+                if not explanations_df.empty:
+                    explanations_df = explanations_df[
+                        explanations_df["email_id"].isin(candidate_emails)
+                    ]
+                explanation_by_email = (
+                    {row["email_id"]: row for _, row in explanations_df.iterrows()}
+                    if not explanations_df.empty
+                    else {}
+                )
+
                 candidate_to_view = st.selectbox(
                     "Select a candidate email to see details:",
                     options=["Select..."] + candidate_emails,
@@ -168,11 +271,74 @@ if not job_listings_df.empty:
                             st.write("🔑 Extracted Key Skills:")
                             st.markdown(candidate_data.get("cv_summary", "N/A"))
                             st.write(f"Status: {candidate_data.get('status', 'N/A')}")
-                            st.write(
-                                f"##### Reason:\n {candidate_data.get('outcome_reason', 'N/A')}"
+                            explanation = explanation_by_email.get(candidate_to_view)
+                            if explanation is not None:
+                                st.write(
+                                    f"✅ Matched skills: {', '.join(explanation['matched']) or 'None'}"
+                                )
+                                st.write(
+                                    f"❌ Missing skills: {', '.join(explanation['missing']) or 'None'}"
+                                )
+                                st.write(
+                                    f"➕ Other skills: {', '.join(explanation['extra']) or 'None'}"
+                                )
+                            # The reason scored for this job; outcome_reason is from whichever job shortlisted them first.
+                            reason = (
+                                explanation["reason"]
+                                if explanation is not None and explanation["reason"]
+                                else candidate_data.get("outcome_reason", "N/A")
                             )
+                            st.write(f"##### Reason:\n {reason}")
                     else:
                         st.warning(f"Could not load details for {candidate_to_view}")
+                elif explanation_by_email:
+                    # Skill overlap of every match, precomputed by match_explanations
+                    all_skills = sorted(
+                        {
+                            skill
+                            for skills in explanations_df["matched"].tolist()
+                            + explanations_df["missing"].tolist()
+                            for skill in skills
+                        }
+                    )
+                    required_skills = st.multiselect(
+                        "Only show candidates with these skills:",
+                        options=all_skills,
+                        key=f"skill_filter_{selected_job_id}",
+                    )
+                    sort_options = {
+                        "Match score": ("match_score", False),
+                        "Skill coverage": ("skill_coverage", False),
+                        "Fewest missing skills": ("missing_count", True),
+                    }
+                    sort_by = st.selectbox(
+                        "Sort by:",
+                        options=list(sort_options),
+                        key=f"skill_sort_{selected_job_id}",
+                    )
+                    shown_df = explanations_df[
+                        explanations_df["matched"].apply(
+                            lambda skills: set(required_skills) <= set(skills)
+                        )
+                    ]
+                    sort_column, ascending = sort_options[sort_by]
+                    shown_df = shown_df.sort_values(
+                        sort_column, ascending=ascending, na_position="last"
+                    )
+                    st.dataframe(
+                        pd.DataFrame(
+                            {
+                                "Email": shown_df["email_id"],
+                                "Score": shown_df["match_score"],
+                                "Skill Coverage": shown_df["skill_coverage"],
+                                "Matched Skills": shown_df["matched"].apply(", ".join),
+                                "Missing Skills": shown_df["missing"].apply(", ".join),
+                                "Other Skills": shown_df["extra"].apply(", ".join),
+                            }
+                        ),
+                        use_container_width=True,
+                        hide_index=True,
+                    )
                 else:
                     # Display the list if none is selected for details view
                     st.dataframe(
@@ -205,6 +371,80 @@ else:
 
 st.sidebar.divider()
 st.sidebar.subheader("View by Candidate")
+search_query = st.sidebar.text_input(
+    "Search resumes",
+    placeholder='kubernetes AND (terraform OR "cloud formation")',
+    help="Keyword search over CV text and summaries. Supports AND, OR, NOT, parentheses and quoted phrases.",
+)
+
+if search_query:
+    st.header(f"🔎 Search results for: {search_query}")
+    search_results = search_resumes(search_query)
+    if search_results.empty:
+        st.info("No resumes match this search.")
+    else:
+        st.dataframe(
+            search_results[["email_id", "cv_filename", "score", "snippet"]],
+            use_container_width=True,
+            hide_index=True,
+        )
+        result_emails = [email for email in search_results["email_id"] if email]
+        candidate_to_view = st.selectbox(
+            "Select a candidate email to see details:",
+            options=["Select..."] + result_emails,
+            key="search_cand_select",
+        )
+        if candidate_to_view != "Select...":
+            candidate_data = load_candidate_details(candidate_to_view)
+            if candidate_data:
+                with st.expander(f"Details for  {candidate_to_view}", expanded=True):
+                    st.write(f"Phone: {candidate_data.get('phone_number', 'N/A')}")
+                    st.write(f"📄 Resume File: {candidate_data.get('cv_filename', 'N/A')}")
+                    st.write("🔑 Extracted Key Skills:")
+                    st.markdown(candidate_data.get("cv_summary", "N/A"))
+                    st.write(f"Status: {candidate_data.get('status', 'N/A')}")
+            else:
+                st.warning(f"Could not load details for {candidate_to_view}")
+
+# --- Export Section ---
+st.sidebar.divider()
+with st.sidebar.expander("📤 Export Data"):
+    export_table_name = st.selectbox("Table", EXPORT_TABLES, key="export_table")
+    export_format = st.selectbox("Format", EXPORT_FORMATS, key="export_format")
+    conn = get_db_connection()
+    export_columns = st.multiselect(
+        "Columns (all if empty)",
+        list(get_table_columns(conn, export_table_name)) if conn else [],
+        key="export_columns",
+    )
+    export_filter_text = st.text_area(
+        "Filters (one per line, all must match)",
+        placeholder="match_score >= 80\nemail_id IS NOT NULL",
+        key="export_filters",
+    )
+    if st.button("Start export"):
+        try:
+            export_filters = [parse_filter(line) for line in export_filter_text.splitlines() if line.strip()]
+        except ValueError as e:
+            st.error(str(e))
+        else:
+            start_export(export_table_name, export_format, export_columns, export_filters)
+    if st.button("Refresh status"):
+        st.rerun()
+    for export_job_id, job in reversed(list(get_export_jobs().items())):
+        if job["status"] == "running":
+            st.write(f"⏳ {export_job_id}: {job['rows']} rows so far")
+        elif job["status"] == "failed":
+            st.write(f"❌ {export_job_id}: {job['error']}")
+        else:
+            st.write(f"✅ {export_job_id}: {job['rows']} rows")
+            with open(job["path"], "rb") as export_file:
+                st.download_button(
+                    "Download",
+                    export_file,
+                    file_name=Path(job["path"]).name,
+                    key=f"download_{export_job_id}",
+                )
 
 # --- About Section ---
 st.sidebar.divider()
@@ -0,0 +1,167 @@
+import os
+import re
+import sqlite3
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from db_utils import add_missing_columns
+
+load_dotenv()
+
+# Cosine similarity of two resume summaries above which they are treated as the same applicant.
+DUPLICATE_SIMILARITY = float(os.getenv("DUPLICATE_SIMILARITY", "0.97"))
+# Neighbours fetched per resume in the self-join; a person rarely applies more often than this.
+DUPLICATE_NEIGHBOURS = 8
+DUPLICATE_BATCH_SIZE = 1024
+# Shorter digit strings are too likely to be OCR fragments to identify anyone.
+MIN_PHONE_DIGITS = 7
+# Values the PII prompt uses as its example, or that CVs and templates carry as filler; they identify no one.
+PLACEHOLDER_EMAILS = {"example@abc.com", "example@example.com", "email@example.com", "test@test.com", "name@email.com"}
+PLACEHOLDER_EMAIL_DOMAINS = {"example.com", "example.org", "example.net", "abc.com", "domain.com", "email.com"}
+SEQUENTIAL_DIGITS = "01234567890"
+
+logger = logging.getLogger(__name__)
+
+
+def create_duplicate_columns(cursor: sqlite3.Cursor) -> None:
+    # NULL for canonical candidates; duplicates point at the candidate that represents their group.
+    add_missing_columns(cursor, "candidates", {"canonical_candidate_id": "INTEGER"})
+    cursor.execute(
+        """CREATE INDEX IF NOT EXISTS idx_candidates_canonical ON candidates (canonical_candidate_id)"""
+    )
+
+
+def normalize_email(email: Optional[str]) -> Optional[str]:
+    """Lower-cased email, or None when it is missing or a placeholder."""
+    email = (email or "").strip().lower()
+    if not email or email in PLACEHOLDER_EMAILS or email.rpartition("@")[2] in PLACEHOLDER_EMAIL_DOMAINS:
+        return None
+    return email
+
+
+def is_placeholder_phone(digits: str) -> bool:
+    """One repeated digit, or a run counting up or down, like 0000000000 or 1234567890."""
+    return (
+        len(set(digits)) == 1
+        or digits in SEQUENTIAL_DIGITS
+        or digits in SEQUENTIAL_DIGITS[::-1]
+    )
+
+
+def normalize_phone(phone: Optional[str]) -> Optional[str]:
+    """Last ten digits of the number, or None when it is too short or a placeholder."""
+    digits = re.sub(r"\D", "", phone or "")
+    # The last ten digits ignore country codes and trunk prefixes written differently across CVs.
+    digits = digits[-10:]
+    if len(digits) < MIN_PHONE_DIGITS or is_placeholder_phone(digits):
+        return None
+    return digits
+
+
+class DisjointSet:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, item: int) -> int:
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, first: int, second: int) -> None:
+        self.parent[self.find(first)] = self.find(second)
+
+
+def similar_pairs(vectors: np.ndarray, threshold: float = DUPLICATE_SIMILARITY) -> List[Tuple[int, int]]:
+    """Row pairs whose cosine similarity is at least threshold, via a batched k-NN self-join.
+
+    vectors must be unit length, so the inner product is the cosine similarity.
+    """
+    import faiss
+
+    if len(vectors) < 2:
+        return []
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    # One extra neighbour, because every resume finds itself first.
+    k = min(DUPLICATE_NEIGHBOURS + 1, len(vectors))
+
+    pairs = []
+    for start in range(0, len(vectors), DUPLICATE_BATCH_SIZE):
+        similarities, neighbours = index.search(vectors[start : start + DUPLICATE_BATCH_SIZE], k)
+        for offset, (row_similarities, row_neighbours) in enumerate(zip(similarities, neighbours)):
+            row = start + offset
+            for similarity, neighbour in zip(row_similarities, row_neighbours):
+                if neighbour == -1 or similarity < threshold:
+                    # Results are sorted by similarity, so the rest of the row is below the threshold too.
+                    break
+                if neighbour != row:
+                    pairs.append((row, int(neighbour)))
+    return pairs
+
+
+def find_canonical_candidates(
+    candidate_ids: List[int],
+    vectors: np.ndarray,
+    emails: List[Optional[str]],
+    phones: List[Optional[str]],
+) -> Dict[int, int]:
+    """Groups near-duplicate resumes and returns duplicate candidate_id -> canonical candidate_id.
+
+    Resumes sharing an email or phone number, or whose summaries are at least DUPLICATE_SIMILARITY
+    alike, end up in one group. The newest resume (highest candidate_id) is the canonical one,
+    since a re-application usually carries the updated CV. Canonical candidates are not in the result.
+    """
+    groups = DisjointSet(len(candidate_ids))
+    for key_name, keys in (
+        ("email", [normalize_email(email) for email in emails]),
+        ("phone", [normalize_phone(phone) for phone in phones]),
+    ):
+        first_row_by_key: Dict[str, int] = {}
+        for row, key in enumerate(keys):
+            if key is None:
+                continue
+            if key in first_row_by_key:
+                # Logged so a wrong merge, e.g. an agency address on several CVs, can be spotted and reviewed.
+                logger.info(
+                    f"Candidate ID: {candidate_ids[row]} shares its {key_name} with "
+                    f"Candidate ID: {candidate_ids[first_row_by_key[key]]}, grouping them"
+                )
+                groups.union(row, first_row_by_key[key])
+            else:
+                first_row_by_key[key] = row
+
+    semantic_pairs = similar_pairs(vectors)
+    for first, second in semantic_pairs:
+        groups.union(first, second)
+
+    canonical_row_by_root: Dict[int, int] = {}
+    for row, candidate_id in enumerate(candidate_ids):
+        root = groups.find(row)
+        if root not in canonical_row_by_root or candidate_id > candidate_ids[canonical_row_by_root[root]]:
+            canonical_row_by_root[root] = row
+
+    canonical_by_duplicate = {}
+    for row, candidate_id in enumerate(candidate_ids):
+        canonical_id = candidate_ids[canonical_row_by_root[groups.find(row)]]
+        if canonical_id != candidate_id:
+            canonical_by_duplicate[candidate_id] = canonical_id
+    similar_pair_count = len({tuple(sorted(pair)) for pair in semantic_pairs})
+    logger.info(
+        f"Found {len(canonical_by_duplicate)} duplicate resumes in "
+        f"{len(set(canonical_by_duplicate.values()))} groups ({similar_pair_count} similar pairs)"
+    )
+    return canonical_by_duplicate
+
+
+def store_canonical_candidates(cursor: sqlite3.Cursor, canonical_by_duplicate: Dict[int, int]) -> None:
+    # Groups are recomputed from scratch on every index build, so earlier assignments are cleared first.
+    create_duplicate_columns(cursor)
+    cursor.execute("""UPDATE candidates SET canonical_candidate_id = NULL WHERE canonical_candidate_id IS NOT NULL""")
+    cursor.executemany(
+        """UPDATE candidates SET canonical_candidate_id = ? WHERE candidate_id = ?""",
+        [(canonical_id, candidate_id) for candidate_id, canonical_id in canonical_by_duplicate.items()],
+    )
@@ -0,0 +1,146 @@
+import os
+import re
+import math
+import sqlite3
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from db_utils import normalize_skills
+
+load_dotenv()
+
+REMOTE_LOCATIONS = {"remote", "anywhere", "work from home", "wfh"}
+# Share of a job's must-have skills a candidate's extracted skills must cover. Extracted skill lists
+# are rarely complete, so requiring every skill would drop candidates the LLM should still see.
+MUST_HAVE_SKILL_COVERAGE = float(os.getenv("MUST_HAVE_SKILL_COVERAGE", "0.75"))
+LOCATION_SEPARATOR_PATTERN = re.compile(r"[,/;|()]+")
+# Other names and common codes of the same place, mapped to one form; shorter codes are only trusted through here.
+LOCATION_ALIASES = {
+    "bengaluru": "bangalore",
+    "bombay": "mumbai",
+    "madras": "chennai",
+    "calcutta": "kolkata",
+    "gurugram": "gurgaon",
+    "new delhi": "delhi",
+    "nyc": "new york",
+    "new york city": "new york",
+    "sf": "san francisco",
+    "in": "india",
+    "ind": "india",
+    "us": "united states",
+    "usa": "united states",
+    "united states of america": "united states",
+    "uk": "united kingdom",
+    "gb": "united kingdom",
+    "england": "united kingdom",
+    "uae": "united arab emirates",
+    "de": "germany",
+    "deutschland": "germany",
+}
+# Location parts shorter than this that are not in LOCATION_ALIASES are ignored, since they are mostly
+# abbreviations that would match unrelated places.
+MIN_LOCATION_PART_LENGTH = 3
+
+logger = logging.getLogger(__name__)
+
+
+def get_job_filters(cursor: sqlite3.Cursor, job_id: int) -> Dict:
+    """Turns the hard requirements extracted by job_summary_extraction into candidate pre-filters."""
+    cursor.execute(
+        """SELECT min_years_experience, job_location, min_degree_level, must_have_skills FROM job_listings WHERE job_id = ?""",
+        (job_id,),
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return {}
+    min_years_experience, job_location, min_degree_level, must_have_skills = row
+
+    filters = {}
+    if min_years_experience:
+        filters["min_years_experience"] = min_years_experience
+    if job_location and job_location not in REMOTE_LOCATIONS:
+        filters["location"] = job_location
+    if min_degree_level:
+        filters["min_degree_level"] = min_degree_level
+    # Normalized again here, so jobs extracted before an alias was added still match the stored skills.
+    if normalize_skills(must_have_skills):
+        filters["must_have_skills"] = normalize_skills(must_have_skills)
+    return filters
+
+
+def location_parts(location: Optional[str]) -> List[Tuple[str, ...]]:
+    """The comma-separated parts of a location, most specific first (city, state, country), as word tuples
+    with aliases resolved.
+    """
+    parts = []
+    for part in LOCATION_SEPARATOR_PATTERN.split((location or "").lower()):
+        part = " ".join(re.findall(r"[a-z0-9]+", part))
+        part = LOCATION_ALIASES.get(part, part)
+        if len(part) >= MIN_LOCATION_PART_LENGTH:
+            parts.append(tuple(part.split()))
+    return parts
+
+
+def contains_words(words: Tuple[str, ...], phrase: Tuple[str, ...]) -> bool:
+    return any(words[start : start + len(phrase)] == phrase for start in range(len(words) - len(phrase) + 1))
+
+
+def location_matches(candidate_location: Optional[str], job_location: Optional[str]) -> bool:
+    """Whether the most specific part of either location is one of the other's parts.
+
+    "houston, tx, usa" matches a job in "united states" and "india" matches "bangalore, india", but
+    "pune, india" does not match "mumbai, india". Parts are compared as whole words, so "new york"
+    matches "new york city" but "us" never matches "houston".
+    """
+    candidate_parts = location_parts(candidate_location)
+    job_parts = location_parts(job_location)
+    if not candidate_parts or not job_parts:
+        return False
+
+    def appears_in(part: Tuple[str, ...], parts: List[Tuple[str, ...]]) -> bool:
+        return any(contains_words(other, part) or contains_words(part, other) for other in parts)
+
+    return appears_in(job_parts[0], candidate_parts) or appears_in(candidate_parts[0], job_parts)
+
+
+def get_eligible_candidate_ids(cursor: sqlite3.Cursor, filters: Dict) -> Optional[List[int]]:
+    """Returns the ids of candidates meeting every filter, or None when there is nothing to filter on.
+
+    Candidates whose attribute was never extracted are kept, so an extraction failure does not
+    silently remove someone from every search.
+    """
+    if not filters:
+        return None
+
+    conditions = ["cv_summary IS NOT NULL", "email_id IS NOT NULL", "canonical_candidate_id IS NULL"]
+    params = []
+    if "min_years_experience" in filters:
+        conditions.append("(years_experience IS NULL OR years_experience >= ?)")
+        params.append(filters["min_years_experience"])
+    if "location" in filters:
+        cursor.connection.create_function("location_matches", 2, location_matches, deterministic=True)
+        conditions.append("(location IS NULL OR location_matches(location, ?))")
+        params.append(filters["location"])
+    if "min_degree_level" in filters:
+        conditions.append("(degree_level IS NULL OR degree_level >= ?)")
+        params.append(filters["min_degree_level"])
+    if filters.get("must_have_skills"):
+        skills = filters["must_have_skills"]
+        placeholders = ", ".join("?" for _ in skills)
+        conditions.append(
+            f"""(skill_tags IS NULL OR candidate_id IN (
+                SELECT candidate_id FROM candidate_skills WHERE skill IN ({placeholders})
+                GROUP BY candidate_id HAVING COUNT(DISTINCT skill) >= ?
+            ))"""
+        )
+        params.extend(skills)
+        params.append(max(1, math.ceil(len(skills) * MUST_HAVE_SKILL_COVERAGE)))
+
+    cursor.execute(
+        f"""SELECT candidate_id FROM candidates WHERE {" AND ".join(conditions)}""", params
+    )
+    candidate_ids = [row[0] for row in cursor.fetchall()]
+    logger.info(f"{len(candidate_ids)} candidates pass the filters {filters}")
+    return candidate_ids
@@ -1,10 +1,19 @@
-from ollama import ChatResponse, chat
 import time
 import sqlite3
 import logging
 import os
 from dotenv import load_dotenv
-import json
+from typing import Optional
+from pydantic import BaseModel
+
+from prompt_budget import (
+    clean_ocr_text,
+    input_budget,
+    log_token_report,
+    map_reduce,
+    split_into_chunks,
+)
+from structured_output import generate_structured, log_parse_report
 
 load_dotenv()
 
@@ -13,12 +22,17 @@ OLLAMA_MODEL = "gemma3:12b"
 PROMPT_TEMPLATE = """Extract phone number and email from below resume.
 Resume:
 {resume_text}
-Only reply in json format don't add```json```:
+Use null for a value that is not in the resume.
+Only reply in json format:
 Example:
-{{"phone_number": "1234567890"}},
-{{"email: "example@abc.com"}}
+{{"phone_number": "1234567890", "email": "example@abc.com"}}
 """
 
+
+class PiiData(BaseModel):
+    phone_number: Optional[str]
+    email: Optional[str]
+
 # --- Logging Setup ---
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
@@ -26,28 +40,39 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def request_pii(candidate_id: int, cv_text: str):
+    pii_data = generate_structured(
+        OLLAMA_MODEL,
+        PROMPT_TEMPLATE.format(resume_text=cv_text),
+        PiiData,
+        options={"temperature": 0.1, "top_k": 30, "top_p": 0.95},
+        record_id=candidate_id,
+    )
+    return pii_data.model_dump() if pii_data else {}
+
+
+def merge_pii(partial_results):
+    """Keeps the first phone number and email found; contact details usually sit on the first page."""
+    dict_pii_data = {}
+    for partial_pii_data in partial_results:
+        for key, value in partial_pii_data.items():
+            if value and key not in dict_pii_data:
+                dict_pii_data[key] = value
+    return dict_pii_data
+
+
 def get_llm_summary(candidate_id: int, cv_text: str):
 
     logger.info(f"Processing job ID: {candidate_id}")
     start = time.monotonic()
     time_taken = 0.0
-    message = {
-        "role": "user",
-        "content": PROMPT_TEMPLATE.format(resume_text=cv_text),
-    }
-    response: ChatResponse = chat(
-        model="gemma3:12b",
-        messages=[message],
-        options={"temperature": 0.1, "top_k": 30, "top_p": 0.95},
-    )
 
-    string_pii_data = response.message.content
-    string_pii_data = string_pii_data.replace("json", "").replace("```", "").strip()
-    try:
-        dict_pii_data = json.loads(string_pii_data)
-    except json.JSONDecodeError:
-        logger.error(f"Failed to parse JSON response: {string_pii_data}, for resume ID: {candidate_id}")
-        dict_pii_data = {}
+    cleaned_cv_text = clean_ocr_text(cv_text)
+    chunks = split_into_chunks(cleaned_cv_text, input_budget(PROMPT_TEMPLATE))
+    dict_pii_data = map_reduce(
+        chunks, lambda chunk: request_pii(candidate_id, chunk), merge_pii
+    )
+    log_token_report("pii", candidate_id, cv_text, cleaned_cv_text, len(chunks))
 
     end = time.monotonic()
     time_taken = round((end - start), 2)
@@ -98,6 +123,7 @@ def main():
             continue
         summary_insertion_function(phone_number, email, cursor, conn, resume_id)
 
+    log_parse_report()
     conn.close()
 
 
@@ -0,0 +1,189 @@
+import os
+import re
+import sqlite3
+import logging
+from typing import Dict, Iterable, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB_PATH = os.getenv("DB_NAME")
+FTS_TABLE = "candidates_fts"
+# bm25 column weights: a hit in the extracted summary counts more than one in raw OCR text.
+OCR_TEXT_WEIGHT = 1.0
+SUMMARY_WEIGHT = 2.0
+# Rank constant of reciprocal rank fusion; 60 is the usual choice and keeps one list from dominating.
+RRF_K = 60
+QUERY_TOKEN_PATTERN = re.compile(r'-?"[^"]*"|\(|\)|[^\s()]+')
+FTS_OPERATORS = {"AND", "OR", "NOT"}
+
+# --- Logging Setup ---
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+def create_search_index(cursor: sqlite3.Cursor) -> None:
+    """Creates the FTS5 index over candidates and the triggers that keep it in sync.
+
+    The index is an external-content table, so the text itself is only stored once, in candidates.
+    """
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+    )
+    index_exists = cursor.fetchone() is not None
+
+    cursor.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+            structured_cv_data, cv_summary,
+            content='candidates', content_rowid='candidate_id',
+            tokenize='porter unicode61'
+        )
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS candidates_fts_insert AFTER INSERT ON candidates BEGIN
+            INSERT INTO {FTS_TABLE} (rowid, structured_cv_data, cv_summary)
+            VALUES (new.candidate_id, new.structured_cv_data, new.cv_summary);
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS candidates_fts_delete AFTER DELETE ON candidates BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, structured_cv_data, cv_summary)
+            VALUES ('delete', old.candidate_id, old.structured_cv_data, old.cv_summary);
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS candidates_fts_update AFTER UPDATE OF structured_cv_data, cv_summary ON candidates BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, structured_cv_data, cv_summary)
+            VALUES ('delete', old.candidate_id, old.structured_cv_data, old.cv_summary);
+            INSERT INTO {FTS_TABLE} (rowid, structured_cv_data, cv_summary)
+            VALUES (new.candidate_id, new.structured_cv_data, new.cv_summary);
+        END
+    """)
+    if not index_exists:
+        # Candidates inserted before the triggers existed are indexed once here.
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')")
+        logger.info("Built the full-text index over existing candidates")
+
+
+def search_index_exists(cursor: sqlite3.Cursor) -> bool:
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)
+    )
+    return cursor.fetchone() is not None
+
+
+def to_fts_query(text: str, allow_operators: bool = True) -> str:
+    """Turns a recruiter query such as `kubernetes and (terraform or "cloud formation") -java` into FTS5 syntax.
+
+    AND/OR/NOT in any case, parentheses and quoted phrases pass through; every other term is quoted,
+    so terms like c++ or node.js cannot break the query. Adjacent terms are implicitly AND-ed, and a
+    term or phrase with a leading "-" excludes it. With allow_operators=False everything except
+    exclusions is treated as a plain term. Raises ValueError for a query that only excludes terms,
+    since FTS5 has no way to match "everything but".
+    """
+    tokens = []
+    excluded = []
+    for token in QUERY_TOKEN_PATTERN.findall(text or ""):
+        if len(token) > 1 and token.startswith("-"):
+            term = token[1:].replace('"', "")
+            if term.strip():
+                excluded.append('"' + term + '"')
+            continue
+        if token in ("(", ")") and not allow_operators:
+            continue
+        if allow_operators and (token.upper() in FTS_OPERATORS or token in ("(", ")")):
+            tokens.append(token.upper())
+        elif len(token) > 1 and token.startswith('"') and token.endswith('"'):
+            if token.strip('"').strip():
+                tokens.append(token)
+        elif token.replace('"', ""):
+            tokens.append('"' + token.replace('"', "") + '"')
+    if not excluded:
+        return " ".join(tokens)
+    if not tokens:
+        raise ValueError(f"Search {text!r} only excludes terms; add at least one term to look for")
+    return f"({' '.join(tokens)}) NOT " + " NOT ".join(excluded)
+
+
+def any_of_query(terms: Iterable[str]) -> str:
+    """FTS5 query matching documents that contain any of the terms (each term as a phrase)."""
+    return " OR ".join('"' + term.replace('"', "") + '"' for term in terms if term.strip())
+
+
+def search_candidates(
+    cursor: sqlite3.Cursor,
+    query: str,
+    limit: int = 20,
+    candidate_ids: Optional[Iterable[int]] = None,
+    raw_query: bool = False,
+) -> List[Dict]:
+    """BM25-ranked keyword search over CV text and summaries, best match first.
+
+    candidate_ids optionally restricts results to those candidates. Pass raw_query=True when
+    query is already FTS5 syntax (e.g. from any_of_query).
+    """
+    fts_query = query if raw_query else to_fts_query(query)
+    if not fts_query or not search_index_exists(cursor):
+        return []
+    allowed_ids = set(candidate_ids) if candidate_ids is not None else None
+
+    sql = f"""
+        SELECT c.candidate_id, c.email_id, c.cv_filename,
+               -bm25({FTS_TABLE}, ?, ?) AS score,
+               snippet({FTS_TABLE}, -1, '**', '**', '…', 12) AS snippet
+        FROM {FTS_TABLE}
+        JOIN candidates c ON c.candidate_id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH ?
+        ORDER BY bm25({FTS_TABLE}, ?, ?)
+    """
+    try:
+        cursor.execute(sql, (OCR_TEXT_WEIGHT, SUMMARY_WEIGHT, fts_query, OCR_TEXT_WEIGHT, SUMMARY_WEIGHT))
+    except sqlite3.OperationalError as e:
+        if raw_query:
+            raise
+        # Unbalanced parentheses or a dangling operator: fall back to matching all terms literally.
+        logger.warning(f"Invalid search query {query!r} ({e}), searching its terms literally")
+        fts_query = to_fts_query(query, allow_operators=False)
+        if not fts_query:
+            return []
+        cursor.execute(sql, (OCR_TEXT_WEIGHT, SUMMARY_WEIGHT, fts_query, OCR_TEXT_WEIGHT, SUMMARY_WEIGHT))
+    results = []
+    # Rows stream in rank order, so filtering stops as soon as enough allowed candidates are found.
+    for candidate_id, email_id, cv_filename, score, snippet in cursor:
+        if allowed_ids is not None and candidate_id not in allowed_ids:
+            continue
+        results.append(
+            {
+                "candidate_id": candidate_id,
+                "email_id": email_id,
+                "cv_filename": cv_filename,
+                "score": round(score, 3),
+                "snippet": snippet,
+            }
+        )
+        if len(results) >= limit:
+            break
+    return results
+
+
+def reciprocal_rank_fusion(*rankings: List[int], k: int = RRF_K) -> List[int]:
+    """Merges several best-first id lists into one, rewarding ids ranked high in any of them."""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, candidate_id in enumerate(ranking, start=1):
+            scores[candidate_id] = scores.get(candidate_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def main():
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    create_search_index(cursor)
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
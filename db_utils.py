@@ -0,0 +1,116 @@
+import sqlite3
+import re
+import hashlib
+from typing import Dict, Iterable, List, Optional
+
+SKILL_SEPARATOR = "||"
+# Match score from which a candidate is shortlisted for a job.
+SHORTLIST_SCORE = 80
+
+DEGREE_LEVELS = {
+    "none": 0,
+    "high school": 0,
+    "diploma": 1,
+    "associate": 1,
+    "bachelor": 2,
+    "master": 3,
+    "mba": 3,
+    "doctorate": 4,
+    "phd": 4,
+}
+
+SKILL_TEXT_SEPARATOR_PATTERN = re.compile(r"[^a-z0-9+#.]+")
+# Spellings that name the same skill, mapped to the one form stored and matched on both the job and resume side.
+SKILL_ALIASES = {
+    "js": "javascript",
+    "ecmascript": "javascript",
+    "ts": "typescript",
+    "py": "python",
+    "python3": "python",
+    "python 3": "python",
+    "golang": "go",
+    "node": "node.js",
+    "nodejs": "node.js",
+    "reactjs": "react",
+    "react.js": "react",
+    "vuejs": "vue",
+    "vue.js": "vue",
+    "angularjs": "angular",
+    "postgres": "postgresql",
+    "ms sql": "sql server",
+    "mssql": "sql server",
+    "k8s": "kubernetes",
+    "aws": "amazon web services",
+    "gcp": "google cloud",
+    "google cloud platform": "google cloud",
+    "azure cloud": "azure",
+    "microsoft azure": "azure",
+    "ml": "machine learning",
+    "dl": "deep learning",
+    "nlp": "natural language processing",
+    "ai": "artificial intelligence",
+    "ci cd": "ci/cd",
+    "sklearn": "scikit-learn",
+    "scikit learn": "scikit-learn",
+    "tf": "tensorflow",
+    "c sharp": "c#",
+    "cpp": "c++",
+    "ms excel": "excel",
+    "microsoft excel": "excel",
+}
+
+
+def add_missing_columns(cursor: sqlite3.Cursor, table: str, columns: Dict[str, str]) -> None:
+    """Adds each column that the table does not have yet; existing columns are left untouched."""
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing_columns = {row[1] for row in cursor.fetchall()}
+    for column, column_type in columns.items():
+        if column not in existing_columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+
+def skill_key(text: Optional[str]) -> str:
+    """Lower-cased words joined by single spaces, keeping the symbols in names like c++, c# or node.js."""
+    words = SKILL_TEXT_SEPARATOR_PATTERN.split((text or "").lower())
+    return " ".join(word.strip(".") for word in words if word.strip("."))
+
+
+def normalize_skill(skill: str) -> str:
+    """The shared vocabulary form of a skill name: its skill_key, with known aliases resolved."""
+    key = skill_key(str(skill))
+    return SKILL_ALIASES.get(key, key)
+
+
+def normalize_skills(skills: Optional[Iterable]) -> List[str]:
+    """Lower-cases, de-duplicates and drops empty skill names, keeping the original order."""
+    if not skills:
+        return []
+    if isinstance(skills, str):
+        skills = re.split(r"[,;\n]|\|\|", skills)
+    normalized = []
+    for skill in skills:
+        skill = normalize_skill(skill)
+        if skill and skill not in normalized:
+            normalized.append(skill)
+    return normalized
+
+
+def degree_level(degree: Optional[str]) -> Optional[int]:
+    """Maps a free-text degree name to an ordinal level, or None when it is not recognised."""
+    if not degree:
+        return None
+    degree = str(degree).lower()
+    levels = [level for name, level in DEGREE_LEVELS.items() if name in degree]
+    return max(levels) if levels else None
+
+
+def to_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def content_hash(text: Optional[str]) -> str:
+    """Short, stable fingerprint of a text field, used to detect when derived results are stale."""
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()[:16]
@@ -2,15 +2,49 @@ import time
 from pathlib import Path
 import sqlite3
 import os
+import hashlib
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
-
-from docling.datamodel.base_models import InputFormat
-from docling.datamodel.pipeline_options import PdfPipelineOptions
-from docling.document_converter import DocumentConverter, PdfFormatOption
-from docling.models.tesseract_ocr_model import TesseractOcrOptions
+from candidate_search import create_search_index
+from db_utils import add_missing_columns
+from prompt_budget import PAGE_SEPARATOR
+from resource_governor import governed_stage, limit_threads, memory_worker_limit, wait_for_memory
 
 load_dotenv()
 
+PAGE_CACHE_DIRECTORY = os.getenv("PAGE_CACHE_DIRECTORY") or "page_cache"
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+# Comma-separated Tesseract languages; unset keeps Docling's defaults.
+OCR_LANGUAGES = [language for language in os.getenv("OCR_LANGUAGES", "").split(",") if language.strip()]
+# Pages with a text layer keep their exact PDF text and only their bitmap regions are OCRed; set this to
+# OCR them in full as well, e.g. when a PDF's text layer is garbled. Scanned pages are always OCRed in full.
+OCR_FORCE_FULL_PAGE = os.getenv("OCR_FORCE_FULL_PAGE", "").lower() in ("1", "true", "yes")
+# Defaults to the OCR stage's core budget from the resource governor.
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0"))
+# Resident memory of one OCR worker with Docling's layout and table models loaded; caps the pool size.
+OCR_WORKER_MEMORY_MB = int(os.getenv("OCR_WORKER_MEMORY_MB", "1500"))
+# Documents rendered and queued ahead of the one being collected, per worker.
+OCR_DOCUMENTS_IN_FLIGHT_PER_WORKER = 2
+# Set to re-run OCR on files that are already in the database, e.g. after changing OCR_LANGUAGES.
+OCR_REPROCESS = os.getenv("OCR_REPROCESS", "").lower() in ("1", "true", "yes")
+SLOW_PAGE_REPORT_COUNT = 10
+# Pages with fewer extractable characters than this are treated as scanned and OCRed from a rendered image.
+MIN_TEXT_LAYER_CHARS = 20
+# Derived from the OCR text by resume_summary_extraction; cleared on re-OCR so they are extracted again.
+DERIVED_CANDIDATE_COLUMNS = ("cv_summary", "skill_tags", "years_experience", "location", "degree", "degree_level")
+
+# --- Logging Setup ---
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Built once per worker process by init_ocr_worker.
+page_converter = None
+
+
 def insert_candidate(cv_filename, structured_cv_data, ocr_time_taken):
     db = os.getenv("DB_NAME")
     conn = sqlite3.connect(db)
@@ -29,54 +63,239 @@ def insert_candidate(cv_filename, structured_cv_data, ocr_time_taken):
             summary_execution_time_minutes REAL
         )
     ''')
+    create_search_index(cursor)
 
-    # Insert the candidate data into the table
-    cursor.execute('''
-        INSERT INTO candidates (cv_filename, structured_cv_data, ocr_execution_time_seconds)
-        VALUES (?, ?, ?)
-    ''', (cv_filename, structured_cv_data, ocr_time_taken))
+    existing = cursor.execute(
+        'SELECT candidate_id FROM candidates WHERE cv_filename = ?', (cv_filename,)
+    ).fetchone()
+    if existing:
+        candidate_id = existing[0]
+        # Clearing the summary and attributes makes resume_summary_extraction pick up the re-OCRed text.
+        cursor.execute('PRAGMA table_info(candidates)')
+        existing_columns = {row[1] for row in cursor.fetchall()}
+        cleared = "".join(f", {column} = NULL" for column in DERIVED_CANDIDATE_COLUMNS if column in existing_columns)
+        cursor.execute(f'''
+            UPDATE candidates SET structured_cv_data = ?, ocr_execution_time_seconds = ?{cleared}
+            WHERE candidate_id = ?
+        ''', (structured_cv_data, ocr_time_taken, candidate_id))
+        if cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'candidate_skills'").fetchone():
+            cursor.execute('DELETE FROM candidate_skills WHERE candidate_id = ?', (candidate_id,))
+    else:
+        # Insert the candidate data into the table
+        cursor.execute('''
+            INSERT INTO candidates (cv_filename, structured_cv_data, ocr_execution_time_seconds)
+            VALUES (?, ?, ?)
+        ''', (cv_filename, structured_cv_data, ocr_time_taken))
+        candidate_id = cursor.lastrowid
 
     conn.commit()
     conn.close()
+    return candidate_id
 
-def main():
-    root = os.getenv("CV_BASE_DIRECTORY")
 
-    for file in os.listdir(root):
-        if file.lower().endswith(".pdf"):
-            input_doc_path = Path(root, file)
+def insert_page_timings(candidate_id, page_timings):
+    conn = sqlite3.connect(os.getenv("DB_NAME"))
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ocr_pages (
+            candidate_id INTEGER NOT NULL,
+            page_no INTEGER NOT NULL,
+            ocr_execution_time_seconds REAL,
+            image_cached INTEGER,
+            PRIMARY KEY (candidate_id, page_no)
+        )
+    ''')
+    add_missing_columns(cursor, 'ocr_pages', {'text_layer': 'INTEGER'})
+    cursor.executemany('''
+        INSERT OR REPLACE INTO ocr_pages (candidate_id, page_no, ocr_execution_time_seconds, image_cached, text_layer)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(candidate_id, *page_timing) for page_timing in page_timings])
+    conn.commit()
+    conn.close()
+
+
+def get_processed_filenames():
+    conn = sqlite3.connect(os.getenv("DB_NAME"))
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT cv_filename FROM candidates')
+        filenames = {row[0] for row in cursor.fetchall()}
+    except sqlite3.OperationalError:
+        filenames = set()
+    conn.close()
+    return filenames
 
-            pipeline_options = PdfPipelineOptions()
-            pipeline_options.do_ocr = True
-            pipeline_options.do_table_structure = True
-            pipeline_options.table_structure_options.do_cell_matching = True
-            pipeline_options.ocr_options = TesseractOcrOptions()
 
-            doc_converter = DocumentConverter(
-                format_options={
-                    InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
-                }
-            )
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-            start_time = time.time()
-            conv_result = doc_converter.convert(input_doc_path)
 
-            ## Export results
-            output_dir = Path("scratch")
-            output_dir.mkdir(parents=True, exist_ok=True)
-            doc_filename = conv_result.input.file.stem
+def has_text_layer(page) -> bool:
+    textpage = page.get_textpage()
+    try:
+        return len(textpage.get_text_range().strip()) >= MIN_TEXT_LAYER_CHARS
+    finally:
+        textpage.close()
 
-            cv_data = conv_result.document.export_to_text()
-            end_time = time.time() - start_time
-            time_taken = round(end_time, 2)
 
+def render_pages(pdf_path, dpi=OCR_DPI):
+    """Splits a PDF into per-page OCR work, in page order, as (source, text_layer, was_cached) tuples.
+
+    Pages with a text layer are converted straight from the PDF, so Docling keeps their exact text.
+    Scanned pages are rasterized to PNG, reusing images cached under the PDF's content hash and the DPI.
+    """
+    import pypdfium2 as pdfium
+
+    cache_dir = Path(PAGE_CACHE_DIRECTORY, file_hash(pdf_path), str(dpi))
+
+    pdf = pdfium.PdfDocument(str(pdf_path))
+    pages = []
+    try:
+        for page_index in range(len(pdf)):
+            page = pdf[page_index]
+            if has_text_layer(page):
+                pages.append((pdf_path, True, False))
+                continue
+            image_path = cache_dir / f"page_{page_index + 1:04d}.png"
+            was_cached = image_path.exists()
+            if not was_cached:
+                cache_dir.mkdir(parents=True, exist_ok=True)
+                image = page.render(scale=dpi / 72).to_pil()
+                # Write then rename, so a crash mid-write never leaves a truncated image in the cache.
+                partial_path = image_path.with_suffix(".partial")
+                image.save(partial_path, format="PNG")
+                partial_path.replace(image_path)
+            pages.append((image_path, False, was_cached))
+    finally:
+        pdf.close()
+    return pages
+
+
+def init_ocr_worker():
+    # Parallelism comes from the pool, so each worker runs Tesseract and Docling's models single-threaded.
+    # Set before docling is imported, since OpenMP reads it once at load.
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    limit_threads(1)
+    # Docling is only imported in the OCR workers; the parent process never converts anything itself.
+    from docling.datamodel.base_models import InputFormat
+    from docling.datamodel.pipeline_options import PdfPipelineOptions
+    from docling.document_converter import DocumentConverter, ImageFormatOption, PdfFormatOption
+    from docling.models.tesseract_ocr_model import TesseractOcrOptions
+
+    global page_converter
+    pipeline_options = PdfPipelineOptions()
+    pipeline_options.do_ocr = True
+    pipeline_options.do_table_structure = True
+    pipeline_options.table_structure_options.do_cell_matching = True
+    ocr_options = {"lang": [language.strip() for language in OCR_LANGUAGES]} if OCR_LANGUAGES else {}
+    pipeline_options.ocr_options = TesseractOcrOptions(
+        force_full_page_ocr=OCR_FORCE_FULL_PAGE, **ocr_options
+    )
+
+    page_converter = DocumentConverter(
+        allowed_formats=[InputFormat.PDF, InputFormat.IMAGE],
+        format_options={
+            InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options),
+            InputFormat.IMAGE: ImageFormatOption(pipeline_options=pipeline_options),
+        },
+    )
+
+
+def ocr_page(source, page_no, text_layer):
+    """Converts one page: page_no of the original PDF when it has a text layer, else its rendered image."""
+    start_time = time.time()
+    if text_layer:
+        conv_result = page_converter.convert(source, page_range=(page_no, page_no))
+    else:
+        conv_result = page_converter.convert(source)
+    page_text = conv_result.document.export_to_text()
+    return page_text, round(time.time() - start_time, 2)
+
+
+def store_document(input_doc_path, render_time, pages, futures, page_reports):
+    """Waits for a document's pages and stores its text and page timings."""
+    page_texts = []
+    page_timings = []
+    try:
+        for page_no, ((_, text_layer, was_cached), future) in enumerate(zip(pages, futures), start=1):
+            page_text, page_time = future.result()
+            page_texts.append(page_text)
+            page_timings.append((page_no, page_time, int(was_cached), int(text_layer)))
+            page_reports.append((page_time, input_doc_path.name, page_no))
+    except Exception:
+        # Nothing is stored for the document, so the next run retries it from the cached page images.
+        logger.exception(f"OCR failed for {input_doc_path.name}")
+        return
+
+    doc_filename = input_doc_path.stem
+    cv_data = PAGE_SEPARATOR.join(page_texts)
+    # Rendering plus per-page OCR time; wall-clock time would include waiting behind other documents.
+    end_time = render_time + sum(page_time for _, page_time, _, _ in page_timings)
+    time_taken = round(end_time, 2)
+
+    candidate_id = insert_candidate(cv_filename=doc_filename,
+                    structured_cv_data=cv_data,
+                    ocr_time_taken=time_taken,
+                    )
+    insert_page_timings(candidate_id, page_timings)
+    logger.info(
+        f"OCR done for {input_doc_path.name}: {len(pages)} pages "
+        f"({sum(text_layer for _, text_layer, _ in pages)} with a text layer, "
+        f"{sum(cached for _, _, cached in pages)} cached images) in {time_taken} seconds"
+    )
+
+
+def main():
+    root = os.getenv("CV_BASE_DIRECTORY")
+    processed_filenames = set() if OCR_REPROCESS else get_processed_filenames()
+
+    documents = []
+    for file in sorted(os.listdir(root)):
+        if file.lower().endswith(".pdf"):
+            input_doc_path = Path(root, file)
+            if input_doc_path.stem in processed_filenames:
+                logger.info(f"Skipping {file}, already in the database")
+                continue
+            documents.append(input_doc_path)
 
-            insert_candidate(cv_filename=doc_filename,
-                            structured_cv_data=cv_data,
-                            ocr_time_taken=time_taken,
-                            )
+    page_reports = []
+    with governed_stage("ocr") as ocr_threads:
+        workers = OCR_WORKERS or ocr_threads
+        memory_limit = None if OCR_WORKERS else memory_worker_limit(OCR_WORKER_MEMORY_MB)
+        if memory_limit is not None and memory_limit < workers:
+            logger.info(f"Available memory fits {memory_limit} OCR workers of {OCR_WORKER_MEMORY_MB} MB, not {workers}")
+            workers = memory_limit
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_ocr_worker) as executor:
+            # Pages of several documents share the pool, so a long scan cannot hold up the rest of the batch,
+            # but only a few documents are queued at a time so memory is checked before each one is taken on.
+            in_flight = deque()
+            for input_doc_path in documents:
+                if len(in_flight) >= workers * OCR_DOCUMENTS_IN_FLIGHT_PER_WORKER:
+                    store_document(*in_flight.popleft(), page_reports)
+                wait_for_memory("ocr")
+                start_time = time.time()
+                try:
+                    pages = render_pages(input_doc_path)
+                except Exception:
+                    # A corrupt or encrypted PDF is skipped; the rest of the batch carries on.
+                    logger.exception(f"Could not open or render {input_doc_path.name}, skipping it")
+                    continue
+                render_time = time.time() - start_time
+                futures = [
+                    executor.submit(ocr_page, source, page_no, text_layer)
+                    for page_no, (source, text_layer, _) in enumerate(pages, start=1)
+                ]
+                in_flight.append((input_doc_path, render_time, pages, futures))
+            while in_flight:
+                store_document(*in_flight.popleft(), page_reports)
 
+    for page_time, filename, page_no in sorted(page_reports, reverse=True)[:SLOW_PAGE_REPORT_COUNT]:
+        logger.info(f"Slow page: {filename} page {page_no} took {page_time} seconds")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -2,11 +2,17 @@ import sqlite3
 import os
 from dotenv import load_dotenv
 import logging
-import json
 from pathlib import Path
-from ollama import ChatResponse, chat
 import time
 from datetime import datetime
+from pydantic import BaseModel, field_validator
+from prompt_budget import (
+    clean_ocr_text,
+    input_budget,
+    log_token_report,
+    split_into_chunks,
+)
+from structured_output import generate_structured, log_parse_report
 
 load_dotenv()
 
@@ -26,12 +32,24 @@ Example:
 {{"email": "<customised email>"}}
 """
 
+
+class CustomEmail(BaseModel):
+    email: str
+
+    @field_validator("email", mode="before")
+    @classmethod
+    def unwrap_nested_email(cls, value):
+        # Models sometimes answer {"email": {"email": "..."}}.
+        if isinstance(value, dict) and "email" in value:
+            return value["email"]
+        return value
+
 def get_custom_email():
     current_date = datetime.now().strftime("%d/%m/%y")
 
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
-    query = """Select job_id, title_and_description from job_listings WHERE custom_emails IS NULL"""
+    query = """Select job_id, title_and_description, job_title, description_summary from job_listings WHERE custom_emails IS NULL"""
 
     cursor.execute(query)
     descriptions = cursor.fetchall()
@@ -40,33 +58,30 @@ def get_custom_email():
     conn.close()
     logger.info(f"Fetched {len(descriptions)} job title and descriptions to process.")
 
-    for job_id, title_and_description in descriptions:
+    for job_id, title_and_description, job_title, description_summary in descriptions:
 
         logger.info(f"Processing job ID: {job_id}")
 
-        message = {
-            "role": "user",
-            "content": PROMPT_TEMPLATE.format(title_and_description=title_and_description, date=current_date),
-        }
+        job_text = clean_ocr_text(title_and_description)
+        if len(split_into_chunks(job_text, input_budget(PROMPT_TEMPLATE))) > 1 and description_summary:
+            # The map-reduced job summary stands in for descriptions that do not fit the context window.
+            logger.info(f"Job ID: {job_id} exceeds the prompt budget, using its extracted summary")
+            job_text = f"JobTitle: {job_title}\n{description_summary}"
+
         start = time.monotonic()
-        response: ChatResponse = chat(
-            model=OLLAMA_MODEL,
-            messages=[message],
+        custom_email = generate_structured(
+            OLLAMA_MODEL,
+            PROMPT_TEMPLATE.format(title_and_description=job_text, date=current_date),
+            CustomEmail,
             options={"temperature": 0.1, "top_k": 25, "top_p": 0.95},
+            record_id=job_id,
         )
         end = time.monotonic()
         time_taken = round((end - start)/60, 2)
         logger.info(f"Time taken for generating custom email for job_id:{job_id} is {time_taken} minutes")
+        log_token_report("email", job_id, title_and_description, job_text, 1)
 
-        response = response.message.content
-        response = response.split("</think>")[1].strip()
-        logger.info("Before String manipulation: " + response)
-        response = response.replace("json", "").replace("```", "").strip()
-        try:
-            email = json.loads(response)
-        except json.JSONDecodeError:
-            logger.error(f"Failed to parse JSON response: {email}, for resume ID: {job_id}")
-            email = {}
+        email = custom_email.model_dump() if custom_email else {}
         insert_custom_email(email, job_id)
 
 def insert_custom_email(custom_email, job_id):
@@ -99,6 +114,7 @@ def insert_custom_email(custom_email, job_id):
 
 def main():
     get_custom_email()
+    log_parse_report()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,251 @@
+import os
+import re
+import csv
+import time
+import uuid
+import sqlite3
+import logging
+import argparse
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB_PATH = os.getenv("DB_NAME")
+EXPORT_DIRECTORY = os.getenv("EXPORT_DIRECTORY") or "exported_data"
+CHUNK_SIZE = 5000
+EXPORT_TABLES = ("candidates", "job_listings", "match_scores")
+EXPORT_FORMATS = ("parquet", "csv", "xlsx")
+FILTER_OPERATORS = ("=", "!=", ">", ">=", "<", "<=", "LIKE", "IS NULL", "IS NOT NULL")
+# "column operator value", e.g. "match_score >= 80"; longer operators first so ">=" is not read as ">".
+FILTER_PATTERN = re.compile(
+    r"^\s*(\w+)\s*(IS NOT NULL|IS NULL|LIKE|!=|>=|<=|=|>|<)\s*(.*?)\s*$", re.IGNORECASE
+)
+# Excel refuses longer cell values; full OCR text is only complete in the Parquet/CSV exports.
+XLSX_MAX_CELL_LENGTH = 32767
+# Spreadsheet apps run cell text starting with these as a formula; OCR and LLM text is untrusted.
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+# --- Logging Setup ---
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+def get_table_columns(conn: sqlite3.Connection, table: str) -> Dict[str, str]:
+    """Column name -> declared SQLite type, in table order."""
+    cursor = conn.execute(f"PRAGMA table_info({table})")
+    return {row[1]: (row[2] or "").upper() for row in cursor.fetchall()}
+
+
+def build_query(conn: sqlite3.Connection, table: str, columns: Optional[List[str]] = None, filters: Optional[List[Tuple]] = None) -> Tuple[str, list, Dict[str, str]]:
+    """Builds a projected, filtered SELECT. Table, column and operator names are checked against
+    whitelists, since they cannot be bound as parameters.
+
+    filters is a list of (column, operator, value) tuples; value is ignored for IS [NOT] NULL.
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown export table: {table}")
+    table_columns = get_table_columns(conn, table)
+    columns = columns or list(table_columns)
+    unknown_columns = [column for column in columns if column not in table_columns]
+    if unknown_columns:
+        raise ValueError(f"Unknown columns for {table}: {unknown_columns}")
+
+    conditions = []
+    params = []
+    for column, operator, value in filters or []:
+        operator = operator.upper()
+        if column not in table_columns or operator not in FILTER_OPERATORS:
+            raise ValueError(f"Invalid filter: {column} {operator}")
+        if operator in ("IS NULL", "IS NOT NULL"):
+            conditions.append(f"{column} {operator}")
+        else:
+            conditions.append(f"{column} {operator} ?")
+            params.append(value)
+
+    query = f"SELECT {', '.join(columns)} FROM {table}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    return query, params, {column: table_columns[column] for column in columns}
+
+
+def parse_filter(text: str) -> Tuple[str, str, Optional[str]]:
+    """Parses "column operator value" into a build_query filter tuple; quotes around the value are optional."""
+    match = FILTER_PATTERN.match(text)
+    if not match:
+        raise ValueError(f"Invalid filter: {text!r}, expected e.g. \"match_score >= 80\"")
+    column, operator, value = match.groups()
+    operator = operator.upper()
+    if operator in ("IS NULL", "IS NOT NULL"):
+        return column, operator, None
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+        value = value[1:-1]
+    return column, operator, value
+
+
+def default_output_path(table: str, export_format: str) -> Path:
+    """A path no other export job uses, so concurrent or repeated exports never overwrite each other."""
+    return Path(
+        EXPORT_DIRECTORY, f"{table}_{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.{export_format}"
+    )
+
+
+def iter_chunks(conn: sqlite3.Connection, query: str, params: list, chunk_size: int = CHUNK_SIZE) -> Iterator[List[tuple]]:
+    cursor = conn.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
+
+def arrow_type(declared_type: str):
+    import pyarrow as pa
+
+    if "INT" in declared_type:
+        return pa.int64()
+    if any(name in declared_type for name in ("REAL", "FLOA", "DOUB")):
+        return pa.float64()
+    if "BLOB" in declared_type:
+        return pa.binary()
+    return pa.string()
+
+
+def to_arrow_value(value, value_type):
+    import pyarrow as pa
+
+    # SQLite does not enforce declared types, so text columns can hold numbers and vice versa.
+    if value is None:
+        return None
+    if value_type == pa.string() and not isinstance(value, str):
+        return str(value)
+    return value
+
+
+def write_parquet(chunks: Iterator[List[tuple]], column_types: Dict[str, str], output_path: Path, on_chunk: Callable[[int], None]) -> None:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # The schema comes from the declared column types, so every chunk is written with the same schema.
+    schema = pa.schema([(column, arrow_type(declared)) for column, declared in column_types.items()])
+    with pq.ParquetWriter(output_path, schema) as writer:
+        for rows in chunks:
+            arrays = [
+                pa.array([to_arrow_value(row[i], field.type) for row in rows], type=field.type)
+                for i, field in enumerate(schema)
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            on_chunk(len(rows))
+
+
+def csv_safe(value):
+    """Prefixes text that a spreadsheet would evaluate as a formula with an apostrophe, so it opens as text."""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def write_csv(chunks: Iterator[List[tuple]], column_types: Dict[str, str], output_path: Path, on_chunk: Callable[[int], None]) -> None:
+    with open(output_path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(column_types)
+        for rows in chunks:
+            writer.writerows([csv_safe(value) for value in row] for row in rows)
+            on_chunk(len(rows))
+
+
+def write_xlsx(chunks: Iterator[List[tuple]], column_types: Dict[str, str], output_path: Path, on_chunk: Callable[[int], None]) -> None:
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+    # Write-only mode streams rows to disk instead of building the whole sheet in memory.
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+
+    def xlsx_value(value):
+        if not isinstance(value, str):
+            return value
+        value = ILLEGAL_CHARACTERS_RE.sub("", value)[:XLSX_MAX_CELL_LENGTH]
+        if not value.startswith(FORMULA_PREFIXES):
+            return value
+        # openpyxl stores text starting with "=" as a formula; a string-typed cell keeps it as plain text.
+        cell = WriteOnlyCell(sheet, value)
+        cell.data_type = "s"
+        return cell
+
+    sheet.append(list(column_types))
+    for rows in chunks:
+        for row in rows:
+            sheet.append([xlsx_value(value) for value in row])
+        on_chunk(len(rows))
+    workbook.save(output_path)
+
+
+WRITERS = {"parquet": write_parquet, "csv": write_csv, "xlsx": write_xlsx}
+
+
+def export_table(
+    table: str,
+    export_format: str,
+    columns: Optional[List[str]] = None,
+    filters: Optional[List[Tuple]] = None,
+    output_path: Optional[str] = None,
+    chunk_size: int = CHUNK_SIZE,
+    progress_callback: Optional[Callable[[int], None]] = None,
+) -> str:
+    """Streams a table out of SQLite in chunks and returns the path of the written file.
+
+    The file is written next to its final path and renamed at the end, so readers never see a
+    partial export. progress_callback receives the running row count after every chunk.
+    """
+    if export_format not in WRITERS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    output_path = Path(output_path or default_output_path(table, export_format))
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    partial_path = output_path.with_name(output_path.name + ".partial")
+
+    exported_rows = 0
+
+    def on_chunk(row_count: int) -> None:
+        nonlocal exported_rows
+        exported_rows += row_count
+        if progress_callback:
+            progress_callback(exported_rows)
+
+    # A separate connection per export, so it can run on a background thread.
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        query, params, column_types = build_query(conn, table, columns, filters)
+        WRITERS[export_format](iter_chunks(conn, query, params, chunk_size), column_types, partial_path, on_chunk)
+    finally:
+        conn.close()
+    partial_path.replace(output_path)
+    logger.info(f"Exported {exported_rows} rows from {table} to {output_path}")
+    return str(output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export database tables to Parquet, CSV or Excel.")
+    parser.add_argument("tables", nargs="*", help=f"Tables to export (default: {', '.join(EXPORT_TABLES)})")
+    parser.add_argument("--format", dest="export_format", default="xlsx", choices=EXPORT_FORMATS)
+    parser.add_argument("--columns", nargs="+", help="Columns to export (default: all)")
+    parser.add_argument(
+        "--filter",
+        dest="filters",
+        action="append",
+        default=[],
+        help='Row filter such as "match_score >= 80" or "email_id IS NOT NULL"; repeat to combine with AND',
+    )
+    args = parser.parse_args()
+    filters = [parse_filter(text) for text in args.filters]
+
+    for table in args.tables or EXPORT_TABLES:
+        export_table(table, args.export_format, columns=args.columns, filters=filters)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,28 @@ import sqlite3
 import logging
 import os
 from dotenv import load_dotenv
+from typing import List, Optional
+from pydantic import BaseModel
+
+from db_utils import (
+    SKILL_SEPARATOR,
+    add_missing_columns,
+    degree_level,
+    normalize_skills,
+    to_float,
+)
+from prompt_budget import (
+    NUM_CTX,
+    clean_ocr_text,
+    estimate_tokens,
+    input_budget,
+    log_token_report,
+    map_reduce,
+    split_into_chunks,
+)
+from model_scheduler import keep_alive_for
+from resource_governor import ollama_runner_options
+from structured_output import generate_structured, log_parse_report
 
 load_dotenv()
 
@@ -13,6 +35,24 @@ PROMPT_TEMPLATE = """Extract key skills, required experience, minimum education,
 Job Description:
 {job_description_text}
 Only reply with the extracted information in a clear text format."""
+MERGE_PROMPT_TEMPLATE = """The following are key skills, required experience, minimum education, desired certifications, main responsibilities and job title extracted from consecutive sections of one job description. Merge them into a single extraction, removing duplicates.
+Extractions:
+{partial_summaries}
+Only reply with the merged information in a clear text format."""
+REQUIREMENTS_PROMPT_TEMPLATE = """Extract the hard requirements a candidate must meet from this job description: minimum years of experience, job location (use "remote" for remote roles), minimum degree and must-have technical skills. Use null when a requirement is not stated.
+Job Description:
+{job_description_text}
+Only reply in json format:
+{{"min_years_experience": <number or null>, "location": "<location or null>", "min_degree": "<degree or null>", "must_have_skills": ["<skill>", ...]}}"""
+
+
+
+class JobRequirements(BaseModel):
+    min_years_experience: Optional[float]
+    location: Optional[str]
+    min_degree: Optional[str]
+    must_have_skills: List[str]
+
 
 # --- Logging Setup ---
 logging.basicConfig(
@@ -21,23 +61,47 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def get_llm_summary(job_id: int, job_text: str):
-
-    logger.info(f"Processing job ID: {job_id}")
-    start = time.monotonic()
-    summary = None
-    time_taken = 0.0
+def request_summary(prompt: str):
     message = {
         "role": "user",
-        "content": PROMPT_TEMPLATE.format(job_description_text=job_text),
+        "content": prompt,
     }
     response: ChatResponse = chat(
-        model="gemma3:12b",
+        model=OLLAMA_MODEL,
         messages=[message],
-        options={"temperature": 0.2, "top_k": 30, "top_p": 0.95},
+        options={"temperature": 0.2, "top_k": 30, "top_p": 0.95, "num_ctx": NUM_CTX, **ollama_runner_options()},
+        keep_alive=keep_alive_for(OLLAMA_MODEL),
+    )
+    return response.message.content, response.prompt_eval_count or 0
+
+
+def merge_summaries(partial_results):
+    partial_summaries = "\n\n".join(summary for summary, _ in partial_results)
+    prompt = MERGE_PROMPT_TEMPLATE.format(partial_summaries=partial_summaries)
+    logger.info(
+        f"Merging {len(partial_results)} partial summaries, merge prompt ~{estimate_tokens(prompt)} of {NUM_CTX} tokens"
     )
+    summary, prompt_eval_count = request_summary(prompt)
+    return summary, prompt_eval_count + sum(count for _, count in partial_results)
+
+
+def get_llm_summary(job_id: int, job_text: str):
+
+    logger.info(f"Processing job ID: {job_id}")
+    start = time.monotonic()
+    summary = None
+    time_taken = 0.0
 
-    summary = response.message.content
+    cleaned_job_text = clean_ocr_text(job_text)
+    chunks = split_into_chunks(cleaned_job_text, input_budget(PROMPT_TEMPLATE))
+    summary, prompt_eval_count = map_reduce(
+        chunks,
+        lambda chunk: request_summary(PROMPT_TEMPLATE.format(job_description_text=chunk)),
+        merge_summaries,
+        result_tokens=lambda result: estimate_tokens(result[0]),
+        reduce_budget=input_budget(MERGE_PROMPT_TEMPLATE),
+    )
+    log_token_report("job_summary", job_id, job_text, cleaned_job_text, len(chunks), prompt_eval_count)
 
     end = time.monotonic()
     time_taken = round((end - start) / 60, 2)
@@ -47,6 +111,40 @@ def get_llm_summary(job_id: int, job_text: str):
     return (summary, time_taken)
 
 
+def get_llm_requirements(job_id: int, job_text: str, description_summary: str):
+
+    logger.info(f"Extracting hard requirements for job ID: {job_id}")
+    cleaned_job_text = clean_ocr_text(job_text)
+    if (
+        len(split_into_chunks(cleaned_job_text, input_budget(REQUIREMENTS_PROMPT_TEMPLATE))) > 1
+        and description_summary
+    ):
+        logger.info(f"Job ID: {job_id} exceeds the prompt budget, extracting requirements from its summary")
+        cleaned_job_text = description_summary
+    requirements = generate_structured(
+        OLLAMA_MODEL,
+        REQUIREMENTS_PROMPT_TEMPLATE.format(job_description_text=cleaned_job_text),
+        JobRequirements,
+        options={"temperature": 0.1, "top_k": 30, "top_p": 0.95},
+        record_id=job_id,
+    )
+    log_token_report("job_requirements", job_id, job_text, cleaned_job_text, 1)
+    return requirements.model_dump() if requirements else {}
+
+
+def create_requirement_columns(cursor: sqlite3.Cursor):
+    add_missing_columns(
+        cursor,
+        "job_listings",
+        {
+            "min_years_experience": "REAL",
+            "job_location": "TEXT",
+            "min_degree_level": "INTEGER",
+            "must_have_skills": "TEXT",
+        },
+    )
+
+
 def resume_extraction_function(cursor: sqlite3.Cursor):
 
     cursor.execute(
@@ -73,15 +171,59 @@ def summary_insertion_function(
     logger.info(f"Successfully updated summary for resume ID: {job_id}")
 
 
+def requirement_extraction_function(cursor: sqlite3.Cursor):
+
+    cursor.execute(
+        """SELECT job_id, title_and_description, description_summary FROM job_listings WHERE must_have_skills IS NULL"""
+    )
+
+    descriptions = cursor.fetchall()
+    logger.info(f"Fetched {len(descriptions)} job descriptions to extract requirements from.")
+    return descriptions
+
+
+def requirement_insertion_function(
+    requirements: dict,
+    cursor: sqlite3.Cursor,
+    conn: sqlite3.Connection,
+    job_id: int,
+):
+    location = requirements.get("location")
+    location = location.strip().lower() if isinstance(location, str) else None
+    min_degree = requirements.get("min_degree")
+    cursor.execute(
+        """UPDATE job_listings SET min_years_experience = ?, job_location = ?, min_degree_level = ?, must_have_skills = ? WHERE job_id = ?""",
+        (
+            to_float(requirements.get("min_years_experience")),
+            location or None,
+            degree_level(min_degree) if isinstance(min_degree, str) else None,
+            SKILL_SEPARATOR.join(normalize_skills(requirements.get("must_have_skills"))),
+            job_id,
+        ),
+    )
+    conn.commit()
+    logger.info(f"Successfully updated requirements for job ID: {job_id}")
+
+
 def main():
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
+    create_requirement_columns(cursor)
     resumes = resume_extraction_function(cursor)
 
     for resume_id, resume_text in resumes:
         summary, time_taken = get_llm_summary(resume_id, resume_text)
         summary_insertion_function(summary, time_taken, cursor, conn, resume_id)
 
+    for job_id, job_text, description_summary in requirement_extraction_function(cursor):
+        requirements = get_llm_requirements(job_id, job_text, description_summary)
+        if not requirements:
+            logger.warning(f"No requirements extracted for job ID: {job_id}, will retry on the next run")
+            continue
+        requirement_insertion_function(requirements, cursor, conn, job_id)
+
+    log_parse_report()
+
     conn.close()
 
 
@@ -0,0 +1,202 @@
+import os
+import sqlite3
+import logging
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+from dotenv import load_dotenv
+
+from db_utils import SHORTLIST_SCORE, normalize_skill, normalize_skills, skill_key
+
+load_dotenv()
+
+DB_PATH = os.getenv("DB_NAME")
+# Longest skill name, in words, looked for in summary text.
+MAX_SKILL_WORDS = 4
+
+# Set-bit count of every byte value, for counting skills in packed bitsets.
+POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+# --- Logging Setup ---
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+def create_explanation_tables(cursor: sqlite3.Cursor) -> None:
+    # Skill ids never change once assigned, so stored bitsets stay readable as the vocabulary grows.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS skill_vocabulary (
+            skill_id INTEGER PRIMARY KEY,
+            skill TEXT NOT NULL UNIQUE
+        )
+    """)
+    # Bit i of each bitset is skill_id i, packed little-endian into bytes.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS match_explanations (
+            job_id INTEGER NOT NULL,
+            candidate_id INTEGER NOT NULL,
+            matched_skills BLOB,
+            missing_skills BLOB,
+            extra_skills BLOB,
+            matched_count INTEGER,
+            missing_count INTEGER,
+            extra_count INTEGER,
+            skill_coverage REAL,
+            PRIMARY KEY (job_id, candidate_id)
+        )
+    """)
+
+
+def text_phrases(text: Optional[str]) -> Set[str]:
+    """Every run of up to MAX_SKILL_WORDS words in the text, for looking up vocabulary skills."""
+    words = skill_key(text).split()
+    return {
+        " ".join(words[start : start + length])
+        for length in range(1, MAX_SKILL_WORDS + 1)
+        for start in range(len(words) - length + 1)
+    }
+
+
+def update_vocabulary(cursor: sqlite3.Cursor, skills: Iterable[str]) -> Dict[str, int]:
+    """Adds unseen skills to the vocabulary and returns the whole vocabulary as skill -> skill_id."""
+    cursor.executemany(
+        """INSERT OR IGNORE INTO skill_vocabulary (skill) VALUES (?)""",
+        [(skill,) for skill in {normalize_skill(skill) for skill in skills} if skill],
+    )
+    cursor.execute("""SELECT skill, skill_id FROM skill_vocabulary""")
+    return dict(cursor.fetchall())
+
+
+def load_vocabulary(cursor: sqlite3.Cursor) -> Dict[int, str]:
+    cursor.execute("""SELECT skill_id, skill FROM skill_vocabulary""")
+    return dict(cursor.fetchall())
+
+
+def skill_ids(vocabulary: Dict[str, int], tagged_skills: Iterable[str], summary: Optional[str]) -> Set[int]:
+    """Vocabulary ids of the extracted skill tags plus every vocabulary skill named in the summary."""
+    ids = {vocabulary[normalize_skill(skill)] for skill in tagged_skills if normalize_skill(skill) in vocabulary}
+    phrases = {normalize_skill(phrase) for phrase in text_phrases(summary)}
+    ids.update(vocabulary[phrase] for phrase in phrases if phrase in vocabulary)
+    return ids
+
+
+def to_bit_matrix(id_sets: List[Set[int]], width: int) -> np.ndarray:
+    """Packs one skill-id set per row into a (rows, ceil(width / 8)) uint8 bitset matrix."""
+    dense = np.zeros((len(id_sets), width), dtype=bool)
+    for row, ids in enumerate(id_sets):
+        dense[row, list(ids)] = True
+    return np.packbits(dense, axis=1, bitorder="little")
+
+
+def bits_to_skill_ids(bits: Optional[bytes]) -> List[int]:
+    if not bits:
+        return []
+    return np.flatnonzero(np.unpackbits(np.frombuffer(bits, dtype=np.uint8), bitorder="little")).tolist()
+
+
+def bits_to_skills(bits: Optional[bytes], vocabulary: Dict[int, str]) -> List[str]:
+    return [vocabulary[skill_id] for skill_id in bits_to_skill_ids(bits) if skill_id in vocabulary]
+
+
+def build_match_explanations() -> int:
+    """Recomputes matched, missing and extra skills for every shortlisted (job, candidate) pair.
+
+    Job skills are the must-have skills plus vocabulary skills named in description_summary;
+    candidate skills are the extracted skill tags plus vocabulary skills named in cv_summary.
+    All pairs are compared at once with bitwise operations on packed bitset matrices.
+    Returns the number of pairs explained.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    create_explanation_tables(cursor)
+
+    cursor.execute(
+        """SELECT m.job_id, m.candidate_id FROM match_scores m
+        JOIN candidates c ON c.candidate_id = m.candidate_id
+        WHERE m.match_score >= ? AND c.canonical_candidate_id IS NULL""",
+        (SHORTLIST_SCORE,),
+    )
+    pairs = cursor.fetchall()
+    if not pairs:
+        cursor.execute("""DELETE FROM match_explanations""")
+        conn.commit()
+        conn.close()
+        logger.info("No shortlisted pairs to explain")
+        return 0
+
+    job_ids = sorted({job_id for job_id, _ in pairs})
+    candidate_ids = sorted({candidate_id for _, candidate_id in pairs})
+    cursor.execute(
+        f"""SELECT job_id, must_have_skills, description_summary FROM job_listings
+        WHERE job_id IN ({", ".join("?" for _ in job_ids)})""",
+        job_ids,
+    )
+    jobs = {job_id: (normalize_skills(skills), summary) for job_id, skills, summary in cursor.fetchall()}
+    cursor.execute(
+        f"""SELECT candidate_id, skill_tags, cv_summary FROM candidates
+        WHERE candidate_id IN ({", ".join("?" for _ in candidate_ids)})""",
+        candidate_ids,
+    )
+    candidates = {candidate_id: (normalize_skills(skills), summary) for candidate_id, skills, summary in cursor.fetchall()}
+
+    vocabulary = update_vocabulary(
+        cursor,
+        [skill for skills, _ in jobs.values() for skill in skills]
+        + [skill for skills, _ in candidates.values() for skill in skills],
+    )
+    width = max(vocabulary.values(), default=0) + 1
+    job_rows = {job_id: row for row, job_id in enumerate(job_ids)}
+    candidate_rows = {candidate_id: row for row, candidate_id in enumerate(candidate_ids)}
+    job_bits = to_bit_matrix([skill_ids(vocabulary, *jobs.get(job_id, ([], None))) for job_id in job_ids], width)
+    candidate_bits = to_bit_matrix(
+        [skill_ids(vocabulary, *candidates.get(candidate_id, ([], None))) for candidate_id in candidate_ids], width
+    )
+
+    # One row per pair: gather both sides, then derive every explanation with whole-matrix operations.
+    pair_job_bits = job_bits[[job_rows[job_id] for job_id, _ in pairs]]
+    pair_candidate_bits = candidate_bits[[candidate_rows[candidate_id] for _, candidate_id in pairs]]
+    matched = pair_job_bits & pair_candidate_bits
+    missing = pair_job_bits & ~pair_candidate_bits
+    extra = pair_candidate_bits & ~pair_job_bits
+    matched_counts = POPCOUNT[matched].sum(axis=1, dtype=np.int64)
+    missing_counts = POPCOUNT[missing].sum(axis=1, dtype=np.int64)
+    extra_counts = POPCOUNT[extra].sum(axis=1, dtype=np.int64)
+    job_skill_counts = matched_counts + missing_counts
+    coverage = np.divide(
+        matched_counts, job_skill_counts, out=np.full(len(pairs), np.nan), where=job_skill_counts > 0
+    )
+
+    # Explanations are cheap to rebuild, so the table always reflects the current shortlist exactly.
+    cursor.execute("""DELETE FROM match_explanations""")
+    cursor.executemany(
+        """INSERT INTO match_explanations (job_id, candidate_id, matched_skills, missing_skills, extra_skills,
+        matched_count, missing_count, extra_count, skill_coverage) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        [
+            (
+                job_id,
+                candidate_id,
+                matched[row].tobytes(),
+                missing[row].tobytes(),
+                extra[row].tobytes(),
+                int(matched_counts[row]),
+                int(missing_counts[row]),
+                int(extra_counts[row]),
+                None if np.isnan(coverage[row]) else round(float(coverage[row]), 3),
+            )
+            for row, (job_id, candidate_id) in enumerate(pairs)
+        ],
+    )
+    conn.commit()
+    conn.close()
+    logger.info(f"Explained {len(pairs)} shortlisted pairs over a vocabulary of {len(vocabulary)} skills")
+    return len(pairs)
+
+
+def main():
+    build_match_explanations()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import time
+import logging
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Optional
+
+import ollama
+
+from prompt_budget import NUM_CTX
+from resource_governor import ollama_runner_options, register_stage
+
+# keep_alive values understood by Ollama: a negative duration keeps the model resident, zero unloads it.
+KEEP_ALIVE_PINNED = -1
+KEEP_ALIVE_RELEASE = 0
+
+logger = logging.getLogger(__name__)
+
+# Models currently pinned by a running scheduler; stage modules pass keep_alive_for(model) on every call.
+pinned_models = set()
+# This process's LLM registration with the resource governor, held while any model is pinned.
+llm_registration = None
+
+
+def keep_alive_for(model: str):
+    """keep_alive to send with a request, so a call made mid-batch does not reset the model's expiry timer."""
+    return KEEP_ALIVE_PINNED if model in pinned_models else None
+
+
+class ModelScheduler:
+    """Runs queued work grouped by Ollama model, loading each model once and pinning it until its queue drains.
+
+    Groups run in the order their model was first submitted, and tasks within a group run in submission
+    order. Work that depends on another model's output belongs in a later run(); statistics accumulate
+    across runs until report() is called. Work submitted with model=None needs no LLM and runs without
+    touching the loaded models. With release_models=False, models stay pinned after their queue drains,
+    for long-running processes that will need them again; release_all() unloads them.
+    """
+
+    def __init__(self, release_models: bool = True):
+        self.release_models = release_models
+        self.queues: "OrderedDict[Optional[str], deque]" = OrderedDict()
+        self.load_count = 0
+        self.cold_load_seconds: Dict[str, float] = {}
+        self.busy_seconds: Dict[Optional[str], float] = {}
+        self.task_counts: Dict[Optional[str], int] = {}
+
+    def submit(self, model: Optional[str], name: str, function: Callable, *args, **kwargs) -> None:
+        self.queues.setdefault(model, deque()).append((name, function, args, kwargs))
+
+    def run(self) -> None:
+        while any(self.queues.values()):
+            model = next(model for model, queue in self.queues.items() if queue)
+            if model is not None and not (model in pinned_models and self.is_loaded(model)):
+                self.load(model)
+            try:
+                self.drain(model)
+            finally:
+                if model is not None and self.release_models:
+                    self.release(model)
+
+    def drain(self, model: Optional[str]) -> None:
+        # Tasks may submit more work for the same model; it is picked up before the model is released.
+        queue = self.queues[model]
+        while queue:
+            name, function, args, kwargs = queue.popleft()
+            logger.info(f"Running {name} on model {model or '-'}")
+            start = time.monotonic()
+            try:
+                function(*args, **kwargs)
+            except Exception:
+                logger.exception(f"Task {name} failed on model {model or '-'}")
+            self.busy_seconds[model] = self.busy_seconds.get(model, 0.0) + time.monotonic() - start
+            self.task_counts[model] = self.task_counts.get(model, 0) + 1
+
+    def is_loaded(self, model: str) -> bool:
+        """Whether Ollama still has the model in memory; a pinned model can still be evicted under memory
+        pressure or by a server restart, and then has to be loaded (and counted) again.
+        """
+        try:
+            return any(running.model == model for running in ollama.ps().models)
+        except Exception as e:
+            logger.warning(f"Could not list the models loaded in Ollama, assuming {model} still is: {e}")
+            return True
+
+    def load(self, model: str) -> None:
+        start = time.monotonic()
+        # An empty prompt only loads the weights; load_duration is reported in nanoseconds. The runner
+        # options match the stage requests, otherwise Ollama reloads the model on the first real call.
+        response = ollama.generate(
+            model=model,
+            prompt="",
+            options={"num_ctx": NUM_CTX, **ollama_runner_options()},
+            keep_alive=KEEP_ALIVE_PINNED,
+        )
+        load_seconds = (response.load_duration or 0) / 1e9
+        global llm_registration
+        pinned_models.add(model)
+        llm_registration = register_stage("llm")
+        self.load_count += 1
+        self.cold_load_seconds[model] = self.cold_load_seconds.get(model, 0.0) + load_seconds
+        logger.info(
+            f"Loaded and pinned model {model}: load {load_seconds:.2f}s, preload call {time.monotonic() - start:.2f}s"
+        )
+
+    def release(self, model: str) -> None:
+        global llm_registration
+        pinned_models.discard(model)
+        if not pinned_models and llm_registration is not None:
+            llm_registration.unlink(missing_ok=True)
+            llm_registration = None
+        ollama.generate(model=model, prompt="", keep_alive=KEEP_ALIVE_RELEASE)
+        logger.info(f"Released model {model}")
+
+    def release_all(self) -> None:
+        for model in list(pinned_models):
+            self.release(model)
+
+    @property
+    def swap_count(self) -> int:
+        return max(self.load_count - 1, 0)
+
+    def report(self) -> None:
+        for model, task_count in self.task_counts.items():
+            logger.info(
+                f"Model {model or '-'}: {task_count} tasks, busy {self.busy_seconds.get(model, 0.0):.1f}s, "
+                f"cold load {self.cold_load_seconds.get(model, 0.0):.2f}s"
+            )
+        total_load_seconds = sum(self.cold_load_seconds.values())
+        logger.info(f"Model swaps: {self.swap_count}, total cold load time: {total_load_seconds:.2f}s")
@@ -0,0 +1,48 @@
+import logging
+import importlib
+from typing import Dict, List, Tuple
+
+# --- Logging Setup ---
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+# Stages of each phase as (module, task name, entry point); a stage runs on its module's OLLAMA_MODEL,
+# or without an LLM when it has none. Modules are imported only when their phase runs, so resumelens
+# can share these definitions without loading every stage up front.
+PHASES: Dict[str, List[Tuple[str, str, str]]] = {
+    "extract": [
+        ("job_summary_extraction", "job summaries", "main"),
+        ("candidate_pii_extraction", "resume PII", "main"),
+        ("resume_summary_extraction", "resume summaries", "main"),
+    ],
+    "index": [("resume_vector_db", "resume vector index", "create_vector_db")],
+    "match": [("resume_matching", "resume matching", "main")],
+    "email": [("email_templating", "email templating", "main")],
+}
+# Each entry is one scheduler.run(); phases in the same run share model loads, later runs see earlier output.
+# Ingestion (job_data_extraction, document_processing) is not repeatable and stays a separate step.
+PIPELINE_RUNS = [["extract"], ["index"], ["match", "email"]]
+
+
+def run_phases(scheduler, phases: List[str]) -> None:
+    """Submits every stage of the given phases and runs them, grouped so every model is loaded once."""
+    for phase in phases:
+        for module_name, task_name, entry_point in PHASES[phase]:
+            module = importlib.import_module(module_name)
+            scheduler.submit(getattr(module, "OLLAMA_MODEL", None), task_name, getattr(module, entry_point))
+    scheduler.run()
+
+
+def main():
+    from model_scheduler import ModelScheduler
+
+    scheduler = ModelScheduler()
+    for phases in PIPELINE_RUNS:
+        run_phases(scheduler, phases)
+    scheduler.report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import os
+import re
+import math
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, TypeVar
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Context window requested from Ollama for every call; its default is small enough to truncate CVs silently.
+NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192"))
+# Tokens kept free for the prompt template and the model's answer.
+RESPONSE_RESERVE_TOKENS = int(os.getenv("OLLAMA_RESPONSE_RESERVE_TOKENS", "2048"))
+CHUNK_OVERLAP_TOKENS = 100
+MAP_WORKERS = int(os.getenv("OLLAMA_MAP_WORKERS", "2"))
+# Rough characters-per-token ratio for English text; Ollama does not expose its tokenizers.
+CHARS_PER_TOKEN = 4
+# document_processing puts a form feed between pages, so headers and footers can be told from body text.
+PAGE_SEPARATOR = "\n\f\n"
+# Lines at the top or bottom of this share of the pages are running headers/footers.
+REPEATED_LINE_PAGE_SHARE = 0.8
+# Non-empty lines at each end of a page that may be a header or footer.
+PAGE_EDGE_LINES = 2
+REPEATED_LINE_MAX_LENGTH = 80
+
+PAGE_NUMBER_PATTERN = re.compile(r"^\s*(page\s*)?\d{1,3}(\s*(of|/)\s*\d{1,3})?\s*$", re.IGNORECASE)
+TABLE_RULE_PATTERN = re.compile(r"^[\s|+\-=_:.]*$")
+TABLE_CELL_GAP_PATTERN = re.compile(r"\s*\|(\s*\|)*\s*")
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def input_budget(prompt_template: str) -> int:
+    """Tokens left for the document once the template and the response reserve are accounted for."""
+    return NUM_CTX - RESPONSE_RESERVE_TOKENS - estimate_tokens(prompt_template)
+
+
+def page_edge_lines(lines: List[str]) -> List[int]:
+    """Positions of the first and last PAGE_EDGE_LINES non-empty lines of a page."""
+    positions = [position for position, line in enumerate(lines) if line]
+    if len(positions) <= 2 * PAGE_EDGE_LINES:
+        return positions
+    return positions[:PAGE_EDGE_LINES] + positions[-PAGE_EDGE_LINES:]
+
+
+def clean_ocr_text(text: Optional[str]) -> str:
+    """Strips OCR noise: page numbers, headers/footers repeated on nearly every page and table rule/cell artifacts.
+
+    Only lines at the top or bottom of a page count as headers/footers, so text without page separators
+    (job descriptions, CVs stored before them) never loses repeated body lines.
+    """
+    if not text:
+        return ""
+    pages = [[line.strip() for line in page.splitlines()] for page in text.split("\f")]
+    edge_positions = [page_edge_lines(lines) for lines in pages]
+    edge_counts = Counter(
+        line
+        for lines, positions in zip(pages, edge_positions)
+        for line in {lines[position].lower() for position in positions}
+        if len(line) <= REPEATED_LINE_MAX_LENGTH
+    )
+    min_pages = max(2, math.ceil(len(pages) * REPEATED_LINE_PAGE_SHARE))
+
+    cleaned_lines = []
+    for lines, positions in zip(pages, edge_positions):
+        edges = set(positions)
+        for position, line in enumerate(lines):
+            if line and (
+                PAGE_NUMBER_PATTERN.match(line)
+                or TABLE_RULE_PATTERN.match(line)
+                or (position in edges and edge_counts[line.lower()] >= min_pages)
+            ):
+                continue
+            line = TABLE_CELL_GAP_PATTERN.sub(" | ", line).strip(" |")
+            line = re.sub(r"[ \t]{2,}", " ", line)
+            cleaned_lines.append(line)
+        cleaned_lines.append("")
+
+    cleaned_text = "\n".join(cleaned_lines)
+    return re.sub(r"\n{3,}", "\n\n", cleaned_text).strip()
+
+
+def split_into_chunks(text: str, max_tokens: int, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    """Splits text on paragraph, then line boundaries into chunks of at most max_tokens, with a small overlap."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    overlap_chars = overlap_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return [text]
+
+    pieces = []
+    for paragraph in text.split("\n\n"):
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        for line in paragraph.splitlines():
+            pieces.extend(
+                line[start : start + max_chars] for start in range(0, len(line), max_chars)
+            )
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(piece) + 2 > max_chars:
+            chunks.append(current)
+            overlap = current[-overlap_chars:] if overlap_chars else ""
+            current = overlap if len(overlap) + len(piece) + 2 <= max_chars else ""
+        current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def budget_batches(items: List[T], item_tokens: List[int], max_tokens: int) -> List[List[T]]:
+    """Groups consecutive items into batches of at most max_tokens, with at least two items per batch
+    (so every reduce round shrinks the list) even when a pair alone is over the budget. Only the last
+    batch can hold a single item.
+    """
+    batches: List[List[T]] = []
+    batch_tokens = 0
+    for item, tokens in zip(items, item_tokens):
+        if batches and (len(batches[-1]) < 2 or batch_tokens + tokens <= max_tokens):
+            batches[-1].append(item)
+            batch_tokens += tokens
+        else:
+            batches.append([item])
+            batch_tokens = tokens
+    return batches
+
+
+def map_reduce(
+    chunks: List[str],
+    map_function: Callable[[str], T],
+    reduce_function: Callable[[List[T]], T],
+    max_workers: int = MAP_WORKERS,
+    result_tokens: Optional[Callable[[T], int]] = None,
+    reduce_budget: Optional[int] = None,
+) -> T:
+    """Runs map_function over the chunks in parallel and merges the results, kept in chunk order.
+
+    With result_tokens and reduce_budget, results that would not fit one reduce prompt together are
+    reduced in budget-sized batches first, repeatedly, until the rest fits a final reduce.
+    """
+    if len(chunks) == 1:
+        return map_function(chunks[0])
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        partial_results = list(executor.map(map_function, chunks))
+        while result_tokens and reduce_budget and len(partial_results) > 2:
+            # One extra token per result for the separator between them in the prompt.
+            tokens = [result_tokens(result) + 1 for result in partial_results]
+            if sum(tokens) <= reduce_budget:
+                break
+            batches = budget_batches(partial_results, tokens, reduce_budget)
+            logger.info(
+                f"{len(partial_results)} partial results (~{sum(tokens)} tokens) exceed the reduce budget of "
+                f"{reduce_budget} tokens, reducing them in {len(batches)} batches first"
+            )
+            # A batch of one has nothing to merge and is carried over as it is.
+            partial_results = list(
+                executor.map(lambda batch: batch[0] if len(batch) == 1 else reduce_function(batch), batches)
+            )
+    return reduce_function(partial_results)
+
+
+def log_token_report(stage: str, record_id, raw_text: str, cleaned_text: str, chunk_count: int, prompt_eval_count: Optional[int] = None) -> None:
+    raw_tokens = estimate_tokens(raw_text)
+    cleaned_tokens = estimate_tokens(cleaned_text)
+    saved = raw_tokens - cleaned_tokens
+    message = (
+        f"[{stage}] ID: {record_id} prompt tokens before cleaning: ~{raw_tokens}, "
+        f"after: ~{cleaned_tokens} (saved ~{saved}), chunks: {chunk_count}"
+    )
+    if prompt_eval_count is not None:
+        message += f", evaluated by model: {prompt_eval_count}"
+    logger.info(message)
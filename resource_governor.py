@@ -0,0 +1,175 @@
+import os
+import sys
+import time
+import logging
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Running stages register a file here, so each process can see what else is competing for the machine.
+GOVERNOR_DIRECTORY = Path(os.getenv("GOVERNOR_DIRECTORY") or ".resource_governor")
+# Relative CPU weight of each stage. Tesseract and CPU inference in the Ollama server scale with cores
+# far better than embedding the short resume summaries does.
+STAGE_WEIGHTS = {"ocr": 2, "embedding": 1, "llm": 2}
+# Below this much available memory, new work waits until running work frees some.
+MIN_AVAILABLE_MEMORY_MB = int(os.getenv("MIN_AVAILABLE_MEMORY_MB", "1024"))
+MEMORY_WAIT_TIMEOUT_SECONDS = 300
+MEMORY_POLL_SECONDS = 1.0
+# Registrations older than this are left over from crashed processes.
+STALE_REGISTRATION_SECONDS = 24 * 60 * 60
+THREAD_LIMIT_VARIABLES = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+logger = logging.getLogger(__name__)
+
+
+def cpu_count() -> int:
+    """Cores this process may run on, which can be fewer than the machine has (containers, taskset)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def available_memory_bytes() -> Optional[int]:
+    """MemAvailable from /proc/meminfo, or None where it cannot be read (no backpressure is applied then)."""
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def registration_is_live(path: Path) -> bool:
+    try:
+        pid = int(path.suffix.lstrip("."))
+        if time.time() - path.stat().st_mtime > STALE_REGISTRATION_SECONDS:
+            return False
+    except (ValueError, OSError):
+        return False
+    if os.name != "posix":
+        # Signal 0 is CTRL_C_EVENT on Windows, so liveness there is judged by age alone.
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def active_stages(include_own: bool = True) -> Dict[str, int]:
+    """Stage name -> number of live processes currently registered for it.
+
+    With include_own=False the calling process's registrations are left out, so a process running one
+    stage after another does not compete with itself.
+    """
+    counts: Dict[str, int] = {}
+    if not GOVERNOR_DIRECTORY.is_dir():
+        return counts
+    own_suffix = f".{os.getpid()}"
+    for path in GOVERNOR_DIRECTORY.iterdir():
+        if not registration_is_live(path):
+            path.unlink(missing_ok=True)
+            continue
+        if not include_own and path.suffix == own_suffix:
+            continue
+        counts[path.stem] = counts.get(path.stem, 0) + 1
+    return counts
+
+
+def thread_budget(stage: str) -> int:
+    """This stage's share of the cores, weighted against the other stages running right now.
+
+    A stage running alone gets every core; the budget is decided when asked for, so a stage that
+    started first keeps its share and later ones divide what is left between them.
+    """
+    stages = active_stages(include_own=False)
+    # Counts the calling process once for this stage, whatever else it has registered.
+    stages[stage] = stages.get(stage, 0) + 1
+    total_weight = sum(STAGE_WEIGHTS.get(name, 1) * count for name, count in stages.items())
+    share = STAGE_WEIGHTS.get(stage, 1) * stages[stage] / total_weight
+    return max(1, int(cpu_count() * share / stages[stage]))
+
+
+def limit_threads(threads: int) -> None:
+    """Caps OpenMP/BLAS thread pools for this process and its children, and torch if it is loaded.
+
+    The environment variables only take effect in libraries imported after this call.
+    """
+    for variable in THREAD_LIMIT_VARIABLES:
+        os.environ[variable] = str(threads)
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+
+
+def register_stage(stage: str) -> Path:
+    GOVERNOR_DIRECTORY.mkdir(parents=True, exist_ok=True)
+    path = GOVERNOR_DIRECTORY / f"{stage}.{os.getpid()}"
+    path.touch()
+    return path
+
+
+@contextmanager
+def governed_stage(stage: str) -> Iterator[int]:
+    """Registers the stage for its duration and yields its thread budget, with thread pools capped to it."""
+    threads = thread_budget(stage)
+    path = register_stage(stage)
+    limit_threads(threads)
+    logger.info(f"Stage {stage}: {threads} of {cpu_count()} cores, running stages: {active_stages()}")
+    try:
+        yield threads
+    finally:
+        path.unlink(missing_ok=True)
+
+
+@lru_cache(maxsize=1)
+def ollama_runner_options() -> Dict[str, int]:
+    """num_thread for Ollama requests from this process, fixed for the process lifetime.
+
+    Ollama reloads a model whenever runner options change, so the budget is decided once. The process
+    is registered as an LLM stage only while ModelScheduler keeps a model pinned. OLLAMA_NUM_THREAD overrides it.
+    """
+    if os.getenv("OLLAMA_NUM_THREAD"):
+        return {"num_thread": int(os.getenv("OLLAMA_NUM_THREAD"))}
+    threads = thread_budget("llm")
+    logger.info(f"Ollama requests from this process use {threads} of {cpu_count()} threads")
+    return {"num_thread": threads}
+
+
+def memory_worker_limit(worker_memory_mb: int, min_available_mb: int = MIN_AVAILABLE_MEMORY_MB) -> Optional[int]:
+    """Worker processes of worker_memory_mb each that fit in available memory above the threshold, at least one.
+
+    None where available memory cannot be read.
+    """
+    available = available_memory_bytes()
+    if available is None:
+        return None
+    spare_mb = available // (1024 * 1024) - min_available_mb
+    return max(1, spare_mb // max(worker_memory_mb, 1))
+
+
+def wait_for_memory(stage: str, min_available_mb: int = MIN_AVAILABLE_MEMORY_MB) -> None:
+    """Blocks while available memory is below the threshold, so new work does not push the machine into swap.
+
+    Gives up after MEMORY_WAIT_TIMEOUT_SECONDS, since the memory may be held by something that never ends.
+    """
+    available = available_memory_bytes()
+    if available is None or available >= min_available_mb * 1024 * 1024:
+        return
+    logger.warning(
+        f"Stage {stage} waiting for memory: {available // (1024 * 1024)} MB available, {min_available_mb} MB wanted"
+    )
+    deadline = time.monotonic() + MEMORY_WAIT_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(MEMORY_POLL_SECONDS)
+        available = available_memory_bytes()
+        if available is None or available >= min_available_mb * 1024 * 1024:
+            return
+    logger.warning(f"Stage {stage} gave up waiting for memory after {MEMORY_WAIT_TIMEOUT_SECONDS}s, continuing")
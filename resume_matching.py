@@ -3,17 +3,34 @@ from pathlib import Path
 import sqlite3
 import logging
 from dotenv import load_dotenv
-import json
 import math
-from ollama import ChatResponse, chat
+import ollama
 import time
 from typing import List, Dict, Tuple
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
+from pydantic import BaseModel, Field
+from resume_vector_db import (
+    get_embeddings,
+    load_vector_index,
+    search_candidate_ids,
+    fetch_candidate_documents,
+    get_index_version,
+)
+from candidate_filters import get_job_filters, get_eligible_candidate_ids
+from candidate_search import create_search_index, search_candidates, any_of_query, reciprocal_rank_fusion
+from structured_output import generate_structured, log_parse_report
+from candidate_dedup import create_duplicate_columns
+from match_explanations import build_match_explanations
+from db_utils import SHORTLIST_SCORE, add_missing_columns, content_hash
 
 load_dotenv()
 
 DB_PATH = os.getenv("DB_NAME")
+OLLAMA_MODEL = "deepseek-r1:14b"
+# Bump when PROMPT_TEMPLATE changes in a way that should invalidate stored scores.
+PROMPT_VERSION = 1
+# Candidates sent to the LLM per job, out of RECALL_K from each of the vector and keyword searches.
+MATCH_TOP_K = 6
+RECALL_K = 20
 
 PROMPT_TEMPLATE = """"Analyze the provided job description and candidate CV. Provide a match score (0-100) and a brief reason for the score in JSON format.
 Job Description: {job_description}
@@ -22,8 +39,10 @@ Only reply in json format don't add```json```:
 Output JSON: {{\"match_score\": <score>, \"reason\": \"<reason>\"}}"
 """
 
-VECTOR_DB_PATH = os.getenv("VECTOR_DB_PATH")
-EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+
+class MatchScore(BaseModel):
+    match_score: float = Field(ge=0, le=100)
+    reason: str
 
 # --- Logging Setup ---
 logging.basicConfig(
@@ -31,11 +50,49 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def create_match_tables(cursor: sqlite3.Cursor) -> None:
+    # One row per scored (job, candidate) pair, stamped with the inputs it was scored against.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS match_scores (
+            job_id INTEGER NOT NULL,
+            candidate_id INTEGER NOT NULL,
+            job_summary_hash TEXT NOT NULL,
+            cv_summary_hash TEXT NOT NULL,
+            model_version TEXT NOT NULL,
+            match_score REAL,
+            reason TEXT,
+            scored_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (job_id, candidate_id)
+        )
+    """)
+    cursor.execute("""CREATE INDEX IF NOT EXISTS idx_match_scores_candidate ON match_scores (candidate_id)""")
+    add_missing_columns(cursor, "job_listings", {"selected_email_ids": "TEXT", "match_state": "TEXT"})
+    add_missing_columns(cursor, "candidates", {"status": "TEXT", "outcome_reason": "TEXT"})
+    create_duplicate_columns(cursor)
+    create_search_index(cursor)
+
+
+def get_model_version() -> str:
+    """Model name plus the local weights digest, so re-pulling a model invalidates its scores."""
+    try:
+        for model in ollama.list().models:
+            if model.model == OLLAMA_MODEL:
+                return f"{OLLAMA_MODEL}@{model.digest[:12]}:v{PROMPT_VERSION}"
+    except Exception as e:
+        logger.warning(f"Could not read the digest of {OLLAMA_MODEL}: {e}")
+    return f"{OLLAMA_MODEL}:v{PROMPT_VERSION}"
+
+
+def get_match_state(job_description: str, model_version: str, index_version: str) -> str:
+    return content_hash(f"{job_description}|{model_version}|{index_version}")
+
+
 def get_job_description() -> List[Tuple]:
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
+    create_match_tables(cursor)
 
-    query = """ SELECT job_id, description_summary FROM job_listings WHERE selected_email_ids IS NULL """
+    query = """ SELECT job_id, description_summary, match_state FROM job_listings WHERE description_summary IS NOT NULL """
     cursor.execute(query)
 
     job_descriptions = cursor.fetchall()
@@ -45,107 +102,181 @@ def get_job_description() -> List[Tuple]:
     logger.info("Fetched Job ID and Job Descriptions from the database.")
     return job_descriptions
 
-def insert_selected_candidates(email_ids_string: str, job_id: str, email_id_reason_dict) -> None:
+def get_matchable_candidate_ids(cursor: sqlite3.Cursor) -> List[int]:
+    """Candidates that are summarized, reachable and not a duplicate, the same set the vector index holds."""
+    cursor.execute(
+        """SELECT candidate_id FROM candidates WHERE cv_summary IS NOT NULL AND email_id IS NOT NULL AND canonical_candidate_id IS NULL"""
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def get_scored_pairs(cursor: sqlite3.Cursor, job_id: int) -> Dict[int, Tuple]:
+    cursor.execute(
+        """SELECT candidate_id, job_summary_hash, cv_summary_hash, model_version FROM match_scores WHERE job_id = ?""",
+        (job_id,),
+    )
+    return {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+
+
+def insert_match_score(cursor: sqlite3.Cursor, job_id: int, candidate_id: int, job_summary_hash: str, cv_summary_hash: str, model_version: str, match_score: float, reason: str) -> None:
+    cursor.execute(
+        """INSERT OR REPLACE INTO match_scores (job_id, candidate_id, job_summary_hash, cv_summary_hash, model_version, match_score, reason, scored_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)""",
+        (job_id, candidate_id, job_summary_hash, cv_summary_hash, model_version, match_score, reason),
+    )
+
+
+def get_shortlisted_candidates(cursor: sqlite3.Cursor, job_id: int, job_summary_hash: str, model_version: str) -> Dict[str, str]:
+    """Email id -> reason for every pair of this job whose score is still valid and above the shortlist mark."""
+    cursor.execute(
+        """SELECT c.email_id, c.cv_summary, m.cv_summary_hash, m.reason FROM match_scores m
+        JOIN candidates c ON c.candidate_id = m.candidate_id
+        WHERE m.job_id = ? AND m.job_summary_hash = ? AND m.model_version = ? AND m.match_score >= ?
+        AND c.canonical_candidate_id IS NULL AND c.cv_summary IS NOT NULL
+        ORDER BY m.match_score DESC""",
+        (job_id, job_summary_hash, model_version, SHORTLIST_SCORE),
+    )
+    return {
+        email_id.strip(): reason
+        for email_id, cv_summary, cv_summary_hash, reason in cursor.fetchall()
+        if email_id and content_hash(cv_summary.strip()) == cv_summary_hash
+    }
+
+
+def insert_selected_candidates(email_ids_string: str, job_id: str, email_id_reason_dict, match_state: str) -> None:
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
 
-    query = """UPDATE job_listings SET selected_email_ids = ? WHERE job_id = ?"""
-    cursor.execute(query, (email_ids_string, job_id))
+    query = """UPDATE job_listings SET selected_email_ids = ?, match_state = ? WHERE job_id = ?"""
+    cursor.execute(query, (email_ids_string, match_state, job_id))
 
     # Candidates table update
     
     for email_id, reason in email_id_reason_dict.items():
         logger.info(f"Updating candidate status for email_id: {email_id}")
-        query = f'''UPDATE candidates SET status = "shortlisted", outcome_reason = "{reason}" WHERE email_id = ? AND status IS NULL'''
-        cursor.execute(query, (email_id,))
+        query = '''UPDATE candidates SET status = 'shortlisted', outcome_reason = ? WHERE email_id = ? AND status IS NULL'''
+        cursor.execute(query, (reason, email_id))
     conn.commit()
     conn.close()
 
 def calculate_cv_job_score(job_description, cv, email_id):
 
-        message = {
-            "role": "user",
-            "content": PROMPT_TEMPLATE.format(job_description=job_description, cv_text = cv),
-        }
         start = time.monotonic()
-        response: ChatResponse = chat(
-            model="deepseek-r1:14b",
-            messages=[message],
+        score_and_reason = generate_structured(
+            OLLAMA_MODEL,
+            PROMPT_TEMPLATE.format(job_description=job_description, cv_text = cv),
+            MatchScore,
             options={"temperature": 0.1, "top_k": 25, "top_p": 0.95},
+            record_id=email_id,
         )
         end = time.monotonic()
         time_taken = round((end - start)/60, 2)
         logger.info(f"Time taken for generating score and reason for email_id:{email_id} is {time_taken} minutes")
 
-        response = response.message.content
-        response = response.split("</think>")[1].strip()
-        logger.info("Before String manipulation: " + response)
-        response = response.replace("json", "").replace("```", "").strip()
+        return score_and_reason.model_dump() if score_and_reason else {}
 
-        try:
-            score_and_reason = json.loads(response)
-        except json.JSONDecodeError:
-            logger.error(f"Failed to parse JSON response: {score_and_reason}, for Email ID: {email_id}")
-            score_and_reason = {}
+def utility(job_id:int, job_description: str, vector_index, embeddings, model_version: str, match_state: str) -> None:
 
-        return score_and_reason
-
-def utility(job_id:int, job_description: str, vector_store) -> None:
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    job_filters = get_job_filters(cursor, job_id)
+    eligible_candidate_ids = get_eligible_candidate_ids(cursor, job_filters)
 
     logger.info(f"similarity search starting for Job ID{job_id}.....")
-    top_cv_documents = vector_store.similarity_search(job_description,
-        k=6,
-        # filter={"source": ""},
-    )
-    
-    email_id_reason_dict = {}
-    email_ids_string = ""
+    query_vector = embeddings.embed_query(job_description)
+    vector_ranking = [
+        candidate_id
+        for candidate_id, _ in search_candidate_ids(
+            vector_index, query_vector, k=RECALL_K, allowed_ids=eligible_candidate_ids
+        )
+    ]
+    # Keyword recall on the must-have skills catches CVs that name a skill the embedding ranks low.
+    skills_query = any_of_query(job_filters.get("must_have_skills") or [])
+    keyword_ranking = [
+        result["candidate_id"]
+        for result in search_candidates(
+            cursor,
+            skills_query,
+            limit=RECALL_K,
+            candidate_ids=get_matchable_candidate_ids(cursor) if eligible_candidate_ids is None else eligible_candidate_ids,
+            raw_query=True,
+        )
+    ] if skills_query else []
+    top_candidate_ids = reciprocal_rank_fusion(vector_ranking, keyword_ranking)[:MATCH_TOP_K]
+    logger.info(f"Hybrid recall for Job ID: {job_id}: {len(vector_ranking)} vector and {len(keyword_ranking)} keyword hits")
+    cv_documents = fetch_candidate_documents(top_candidate_ids)
+    job_summary_hash = content_hash(job_description)
+    scored_pairs = get_scored_pairs(cursor, job_id)
+    new_scores = 0
+    # The match state is only recorded once every retrieved pair is scored, so failed pairs are retried next run.
+    all_pairs_scored = True
 
-    for cv_doc in top_cv_documents:
-        cv = cv_doc.page_content
-        email_id = cv_doc.metadata["email_id"]
-        cv_filename = cv_doc.metadata["cv_filename"]
+    for candidate_id in top_candidate_ids:
+        if candidate_id not in cv_documents:
+            logger.warning(f"Candidate ID: {candidate_id} is in the vector index but not in the database")
+            continue
+        cv = cv_documents[candidate_id]["cv_summary"]
+        email_id = cv_documents[candidate_id]["email_id"]
+        cv_filename = cv_documents[candidate_id]["cv_filename"]
+        cv_summary_hash = content_hash(cv)
+        if scored_pairs.get(candidate_id) == (job_summary_hash, cv_summary_hash, model_version):
+            logger.info(f"Resume: {cv_filename} is already scored against Job ID: {job_id}, skipping")
+            continue
         logger.info(f"Started processing Resume: {cv_filename} with Email: {email_id} against Job ID: {job_id}")
         
         score_and_reason = calculate_cv_job_score(job_description, cv, email_id)
 
         if score_and_reason is None:
             logger.error(f"Failed to calculate score for email_id: {email_id}")
+            all_pairs_scored = False
+            continue
 
         match_score = score_and_reason.get("match_score", None)
         reason = score_and_reason.get("reason", None)
 
         if match_score is None:
             logger.error(f"Match score is None for email_id: {email_id}")
+            all_pairs_scored = False
+            continue
             
         if reason is None:
             logger.error(f"Reason is None for email_id: {email_id}")
 
-        if math.ceil(match_score) >= 80:
-            email_ids_string = email_ids_string + "||" + email_id
-            email_id_reason_dict[email_id] = reason
-    insert_selected_candidates(email_ids_string, job_id, email_id_reason_dict)        
+        insert_match_score(cursor, job_id, candidate_id, job_summary_hash, cv_summary_hash, model_version, math.ceil(match_score), reason)
+        conn.commit()
+        new_scores += 1
+
+    email_id_reason_dict = get_shortlisted_candidates(cursor, job_id, job_summary_hash, model_version)
+    conn.close()
+    logger.info(f"Scored {new_scores} new or changed pairs for Job ID: {job_id}")
+
+    email_ids_string = "".join("||" + email_id for email_id in email_id_reason_dict)
+    insert_selected_candidates(email_ids_string, job_id, email_id_reason_dict, match_state if all_pairs_scored else None)
 
 
 def main():
     
     logger.info("Setting up the model and vector store.....")
-    model_kwargs = {"device": "cpu", "trust_remote_code": True}
-    embeddings = HuggingFaceEmbeddings(
-        model_name=EMBEDDING_MODEL, model_kwargs=model_kwargs
-    )
+    embeddings = get_embeddings()
+    vector_index = load_vector_index()
 
-    vector_store = FAISS.load_local(
-        "faiss_index", embeddings, allow_dangerous_deserialization=True
-    )
+    model_version = get_model_version()
+    index_version = get_index_version()
 
     logger.info("Set up completed.....")
 
     for jobid_and_description in get_job_description():
         job_id = jobid_and_description[0]
         job_description = jobid_and_description[1].strip()
+        match_state = get_match_state(job_description, model_version, index_version)
+        if jobid_and_description[2] == match_state:
+            logger.info(f"Job ID: {job_id}, its candidate pool and the model are unchanged since the last match, skipping")
+            continue
         
-        utility(job_id, job_description, vector_store)
+        utility(job_id, job_description, vector_index, embeddings, model_version, match_state)
+    # Skill explanations for every shortlisted pair, so the dashboard never needs the reasoning model for them.
+    build_match_explanations()
+    log_parse_report()
     print("_" * 60)
 
 if __name__ == "__main__":
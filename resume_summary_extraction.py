@@ -3,6 +3,29 @@ from pathlib import Path
 import time
 import sqlite3
 import logging
+from typing import List, Optional
+from pydantic import BaseModel
+
+from db_utils import (
+  SKILL_SEPARATOR,
+  add_missing_columns,
+  degree_level,
+  normalize_skill,
+  normalize_skills,
+  to_float,
+)
+from prompt_budget import (
+  NUM_CTX,
+  clean_ocr_text,
+  estimate_tokens,
+  input_budget,
+  log_token_report,
+  map_reduce,
+  split_into_chunks,
+)
+from model_scheduler import keep_alive_for
+from resource_governor import ollama_runner_options
+from structured_output import generate_structured, log_parse_report
 
 DB_PATH = Path("candidates.db")
 OLLAMA_MODEL = 'gemma3:12b'
@@ -10,6 +33,21 @@ PROMPT_TEMPLATE = """Extract key skills, experience, education, certifications,
 Resume:
 {resume_text}
 Only reply with the extracted information in a clear text format."""
+MERGE_PROMPT_TEMPLATE = """The following are key skills, experience, education, certifications, achievements and job titles extracted from consecutive sections of one resume. Merge them into a single extraction, removing duplicates.
+Extractions:
+{partial_summaries}
+Only reply with the merged information in a clear text format."""
+ATTRIBUTE_PROMPT_TEMPLATE = """Extract the candidate's total years of professional experience, current location (city and/or country), highest degree and technical skills from this resume.
+Resume:
+{resume_text}
+Only reply in json format:
+{{"years_experience": <number>, "location": "<location>", "degree": "<highest degree>", "skills": ["<skill>", ...]}}"""
+
+class CandidateAttributes(BaseModel):
+  years_experience: Optional[float]
+  location: Optional[str]
+  degree: Optional[str]
+  skills: List[str]
 
 # --- Logging Setup ---
 logging.basicConfig(
@@ -17,25 +55,84 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def request_summary(prompt: str):
+  message = {'role': 'user',
+             'content': prompt}
+  response: ChatResponse = chat(model=OLLAMA_MODEL,
+                                messages=[message],
+                                options={'temperature': 0.2, 'top_k': 30, 'top_p': 0.95, 'num_ctx': NUM_CTX, **ollama_runner_options()},
+                                keep_alive=keep_alive_for(OLLAMA_MODEL))
+  return response.message.content, response.prompt_eval_count or 0
+
+def merge_summaries(partial_results):
+  partial_summaries = "\n\n".join(summary for summary, _ in partial_results)
+  prompt = MERGE_PROMPT_TEMPLATE.format(partial_summaries=partial_summaries)
+  logger.info(f"Merging {len(partial_results)} partial summaries, merge prompt ~{estimate_tokens(prompt)} of {NUM_CTX} tokens")
+  summary, prompt_eval_count = request_summary(prompt)
+  return summary, prompt_eval_count + sum(count for _, count in partial_results)
+
 def get_llm_summary(resume_id: int, resume_text: str):
 
     logger.info(f"Processing resume ID: {resume_id}")
     start = time.monotonic()
     summary = None
     time_taken = 0.0
-    message = {'role': 'user',
-                'content': PROMPT_TEMPLATE.format(resume_text= resume_text)}
-    response: ChatResponse = chat(model='gemma3:12b',
-                                    messages=[message],
-                                    options={'temperature': 0.2, 'top_k': 30, 'top_p': 0.95})
 
-    summary = response.message.content
+    cleaned_resume_text = clean_ocr_text(resume_text)
+    chunks = split_into_chunks(cleaned_resume_text, input_budget(PROMPT_TEMPLATE))
+    summary, prompt_eval_count = map_reduce(
+      chunks, lambda chunk: request_summary(PROMPT_TEMPLATE.format(resume_text=chunk)), merge_summaries,
+      result_tokens=lambda result: estimate_tokens(result[0]), reduce_budget=input_budget(MERGE_PROMPT_TEMPLATE)
+    )
+    log_token_report('resume_summary', resume_id, resume_text, cleaned_resume_text, len(chunks), prompt_eval_count)
 
     end = time.monotonic()
     time_taken = round((end - start)/60, 2)
     logger.info(f"Received summary for resume ID: {resume_id} Time Taken: {time_taken} minutes")
     return (summary, time_taken)
 
+def get_llm_attributes(resume_id: int, resume_text: str, cv_summary: str):
+
+  logger.info(f"Extracting structured attributes for resume ID: {resume_id}")
+  cleaned_resume_text = clean_ocr_text(resume_text)
+  if len(split_into_chunks(cleaned_resume_text, input_budget(ATTRIBUTE_PROMPT_TEMPLATE))) > 1 and cv_summary:
+    # The merged summary already condenses an oversized resume into one context window.
+    logger.info(f"Resume ID: {resume_id} exceeds the prompt budget, extracting attributes from its summary")
+    cleaned_resume_text = cv_summary
+  attributes = generate_structured(OLLAMA_MODEL,
+                                   ATTRIBUTE_PROMPT_TEMPLATE.format(resume_text=cleaned_resume_text),
+                                   CandidateAttributes,
+                                   options={'temperature': 0.1, 'top_k': 30, 'top_p': 0.95},
+                                   record_id=resume_id)
+  log_token_report('resume_attributes', resume_id, resume_text, cleaned_resume_text, 1)
+  return attributes.model_dump() if attributes else {}
+
+def create_attribute_columns(cursor: sqlite3.Cursor):
+  add_missing_columns(cursor, 'candidates', {
+    'years_experience': 'REAL',
+    'location': 'TEXT',
+    'degree': 'TEXT',
+    'degree_level': 'INTEGER',
+    'skill_tags': 'TEXT',
+  })
+  cursor.execute('''CREATE TABLE IF NOT EXISTS candidate_skills (
+                      candidate_id INTEGER NOT NULL,
+                      skill TEXT NOT NULL,
+                      PRIMARY KEY (candidate_id, skill)
+                    )''')
+  cursor.execute('''CREATE INDEX IF NOT EXISTS idx_candidate_skills_skill ON candidate_skills (skill, candidate_id)''')
+  cursor.execute('''CREATE INDEX IF NOT EXISTS idx_candidates_years_experience ON candidates (years_experience)''')
+  cursor.execute('''CREATE INDEX IF NOT EXISTS idx_candidates_location ON candidates (location)''')
+  cursor.execute('''CREATE INDEX IF NOT EXISTS idx_candidates_degree_level ON candidates (degree_level)''')
+  # Rows stored before the shared skill vocabulary (or a new alias) are brought to its current form.
+  cursor.execute('''SELECT candidate_id, skill FROM candidate_skills''')
+  stale_skills = [(candidate_id, skill) for candidate_id, skill in cursor.fetchall() if normalize_skill(skill) != skill]
+  cursor.executemany('''DELETE FROM candidate_skills WHERE candidate_id = ? AND skill = ?''', stale_skills)
+  cursor.executemany('''INSERT OR IGNORE INTO candidate_skills (candidate_id, skill) VALUES (?, ?)''',
+                     [(candidate_id, normalize_skill(skill)) for candidate_id, skill in stale_skills if normalize_skill(skill)])
+  # Blank locations matched every job location in the filters; unknown is NULL.
+  cursor.execute("UPDATE candidates SET location = NULL WHERE TRIM(location) = ''")
+
 def resume_extraction_function(cursor: sqlite3.Cursor):
 
   cursor.execute('''SELECT candidate_id, structured_cv_data FROM candidates WHERE cv_summary IS NULL''')
@@ -44,22 +141,57 @@ def resume_extraction_function(cursor: sqlite3.Cursor):
   logger.info(f"Fetched {len(resumes)} resumes to process.")
   return resumes
 
+def attribute_extraction_function(cursor: sqlite3.Cursor):
+
+  cursor.execute('''SELECT candidate_id, structured_cv_data, cv_summary FROM candidates WHERE skill_tags IS NULL''')
+
+  resumes = cursor.fetchall()
+  logger.info(f"Fetched {len(resumes)} resumes to extract attributes from.")
+  return resumes
+
 def summary_insertion_function(summary:str, time_taken: float, cursor: sqlite3.Cursor, conn: sqlite3.Connection, resume_id: int):
   cursor.execute('''UPDATE candidates SET cv_summary = ?, summary_execution_time_minutes = ? WHERE candidate_id = ?''',(summary, time_taken, resume_id))
   conn.commit()
   logger.debug(f"Successfully updated summary for resume ID: {resume_id}")
-     
+
+def attribute_insertion_function(attributes: dict, cursor: sqlite3.Cursor, conn: sqlite3.Connection, resume_id: int):
+  skills = normalize_skills(attributes.get('skills'))
+  location = attributes.get('location')
+  location = (location.strip().lower() or None) if isinstance(location, str) else None
+  degree = attributes.get('degree') or None
+  cursor.execute('''UPDATE candidates SET years_experience = ?, location = ?, degree = ?, degree_level = ?, skill_tags = ? WHERE candidate_id = ?''',
+                 (to_float(attributes.get('years_experience')),
+                  location,
+                  degree if isinstance(degree, str) else None,
+                  degree_level(degree),
+                  SKILL_SEPARATOR.join(skills),
+                  resume_id))
+  cursor.execute('''DELETE FROM candidate_skills WHERE candidate_id = ?''', (resume_id,))
+  cursor.executemany('''INSERT OR IGNORE INTO candidate_skills (candidate_id, skill) VALUES (?, ?)''',
+                     [(resume_id, skill) for skill in skills])
+  conn.commit()
+  logger.debug(f"Successfully updated attributes for resume ID: {resume_id}")
+
 
 def main():
   conn = sqlite3.connect(DB_PATH)
   cursor = conn.cursor()
+  create_attribute_columns(cursor)
   resumes = resume_extraction_function(cursor)
 
   for resume_id, resume_text in resumes:
     summary, time_taken = get_llm_summary(resume_id, resume_text)
     summary_insertion_function(summary, time_taken, cursor, conn, resume_id)
 
+  for resume_id, resume_text, cv_summary in attribute_extraction_function(cursor):
+    attributes = get_llm_attributes(resume_id, resume_text, cv_summary)
+    if not attributes:
+      logger.warning(f"No attributes extracted for resume ID: {resume_id}, will retry on the next run")
+      continue
+    attribute_insertion_function(attributes, cursor, conn, resume_id)
+
+  log_parse_report()
   conn.close()
 
 if __name__ == "__main__":
-  main()
\ No newline at end of file
+  main()
@@ -1,21 +1,25 @@
 import os
 from dotenv import load_dotenv
 import sqlite3
-from uuid import uuid4
-import faiss
 import logging
-from ollama import ChatResponse, chat
+from functools import lru_cache
+import numpy as np
+from typing import Dict, List, Optional, Tuple
 
-from langchain_community.docstore.in_memory import InMemoryDocstore
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_core.documents import Document
+from candidate_dedup import find_canonical_candidates, store_canonical_candidates
+from db_utils import add_missing_columns
+from resource_governor import governed_stage, limit_threads, thread_budget, wait_for_memory
 
 load_dotenv()
 
 DB_PATH = os.getenv("DB_NAME")
-VECTOR_DB_PATH = os.getenv("VECTOR_DB_PATH")
+VECTOR_DB_PATH = os.getenv("VECTOR_DB_PATH") or "faiss_index"
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+INDEX_FILENAME = "resumes.faiss"
+# Summaries embedded per call; memory is checked between batches.
+EMBEDDING_BATCH_SIZE = 64
+# Below this many eligible candidates an exact scan beats a filtered HNSW walk, which degrades on sparse selections.
+EXACT_SEARCH_LIMIT = 512
 
 # --- Logging Setup ---
 logging.basicConfig(
@@ -23,57 +27,177 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def create_vector_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("""Select cv_summary, cv_filename, email_id from candidates""")
-    resume_details = cursor.fetchall()
-    conn.commit()
-    conn.close()
-
-    documents = []
+# (index version, index) of the last index opened, so a long-running process reopens it only after a rebuild.
+loaded_index = (None, None)
 
-    for resume_detail in resume_details:
-        
-        cv_summary = resume_detail[0].strip()
-        cv_filename = resume_detail[1].strip()
-        email_id = resume_detail[2].strip()
-        documents.append(
-            Document(
-                page_content=cv_summary,
-                metadata={"cv_filename": cv_filename, "email_id": email_id},
-            )
-        )
 
-    print(len(documents))
-    uuids = [str(uuid4()) for _ in range(len(documents))]
+@lru_cache(maxsize=1)
+def get_embeddings():
+    """Loads the sentence-transformer once per process; later calls reuse the loaded model."""
+    # Caps torch's thread pool before it is created, so embedding does not take every core from OCR and Ollama.
+    limit_threads(thread_budget("embedding"))
+    # Imported here because it pulls in torch, which dominates startup for stages that never embed.
+    from langchain_huggingface import HuggingFaceEmbeddings
 
     model_kwargs = {"device": "cpu", "trust_remote_code": True}
-    embeddings = HuggingFaceEmbeddings(
-        model_name=EMBEDDING_MODEL, model_kwargs=model_kwargs
+    # Unit-length vectors make L2 distance on the index rank the same as cosine similarity.
+    encode_kwargs = {"normalize_embeddings": True}
+    return HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL, model_kwargs=model_kwargs, encode_kwargs=encode_kwargs
     )
 
-    dimension = len(embeddings.embed_query("hello world"))
-    index = faiss.IndexHNSWFlat(dimension, 32)
-    index.hnsw.efConstruction = 200
-    index.hnsw.efSearch = 64
 
-    print("embedding dimension: ", dimension)
+def get_index_path() -> str:
+    return os.path.join(VECTOR_DB_PATH, INDEX_FILENAME)
 
-    vector_store = FAISS(
-        embedding_function=embeddings,
-        index=index,
-        docstore=InMemoryDocstore(),
-        index_to_docstore_id={},
-    )
 
-    vector_store.add_documents(documents=documents, ids=uuids)
-    logger.info("documents converted to embeddings and added to vector database")
+def create_vector_db():
+    import faiss
 
-    vector_store.save_local("faiss_index")
-    logger.info("database stored locally")
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    add_missing_columns(cursor, "candidates", {"phone_number": "TEXT"})
+
+    cursor.execute(
+        """Select candidate_id, cv_summary, email_id, phone_number from candidates WHERE cv_summary IS NOT NULL AND email_id IS NOT NULL"""
+    )
+    resume_details = cursor.fetchall()
+
+    candidate_ids = [resume_detail[0] for resume_detail in resume_details]
+    cv_summaries = [resume_detail[1].strip() for resume_detail in resume_details]
+    logger.info(f"Fetched {len(cv_summaries)} resume summaries to embed.")
+
+    embeddings = get_embeddings()
+    vector_batches = []
+    with governed_stage("embedding"):
+        for start in range(0, len(cv_summaries), EMBEDDING_BATCH_SIZE):
+            wait_for_memory("embedding")
+            vector_batches.extend(embeddings.embed_documents(cv_summaries[start : start + EMBEDDING_BATCH_SIZE]))
+    vectors = np.asarray(vector_batches, dtype="float32")
+    dimension = vectors.shape[1] if len(vectors) else len(embeddings.embed_query("hello world"))
+    logger.info(f"embedding dimension: {dimension}")
+
+    # Repeat applications are collapsed to one canonical candidate, and only canonical ones are indexed,
+    # so duplicates never reach matching.
+    canonical_by_duplicate = find_canonical_candidates(
+        candidate_ids,
+        vectors,
+        [resume_detail[2] for resume_detail in resume_details],
+        [resume_detail[3] for resume_detail in resume_details],
+    )
+    store_canonical_candidates(cursor, canonical_by_duplicate)
+    conn.commit()
+    conn.close()
+    canonical_rows = [row for row, candidate_id in enumerate(candidate_ids) if candidate_id not in canonical_by_duplicate]
+    candidate_ids = [candidate_ids[row] for row in canonical_rows]
+    vectors = vectors[canonical_rows]
+
+    hnsw_index = faiss.IndexHNSWFlat(dimension, 32)
+    hnsw_index.hnsw.efConstruction = 200
+    hnsw_index.hnsw.efSearch = 64
+
+    # The vector ids are the candidates.candidate_id values, so a hit maps straight back to its row.
+    index = faiss.IndexIDMap2(hnsw_index)
+    if len(vectors):
+        index.add_with_ids(vectors, np.asarray(candidate_ids, dtype="int64"))
+    logger.info(f"{len(candidate_ids)} documents converted to embeddings and added to vector database")
+
+    os.makedirs(VECTOR_DB_PATH, exist_ok=True)
+    faiss.write_index(index, get_index_path())
+    logger.info(f"database stored locally at {get_index_path()}")
+
+
+def load_vector_index():
+    """Reads the saved index into memory, reusing the loaded copy until the file is rebuilt.
+
+    FAISS only memory-maps the inverted lists of IVF indexes, so an HNSW index is always read in full
+    and each matcher process holds its own copy.
+    """
+    import faiss
+
+    global loaded_index
+    index_version = get_index_version()
+    if loaded_index[0] == index_version:
+        return loaded_index[1]
+    index = faiss.read_index(get_index_path())
+    loaded_index = (index_version, index)
+    logger.info(f"Loaded vector index with {index.ntotal} resumes from {get_index_path()}")
+    return index
+
+
+def get_index_version() -> str:
+    """Changes whenever the index file is rebuilt, so callers can tell if the candidate pool may have changed."""
+    index_stat = os.stat(get_index_path())
+    return f"{index_stat.st_mtime_ns}-{index_stat.st_size}"
+
+
+def search_candidate_ids(
+    index, query_vector: np.ndarray, k: int, allowed_ids: Optional[List[int]] = None
+) -> List[Tuple[int, float]]:
+    """Returns (candidate_id, distance) pairs for the k nearest resumes, closest first.
+
+    When allowed_ids is given, only those candidates are considered: small pools are scanned
+    exactly and larger ones are searched through an IDSelector, so no post-filtering is needed.
+    """
+    import faiss
+
+    query = np.asarray(query_vector, dtype="float32").reshape(1, -1)
+    if allowed_ids is None:
+        distances, labels = index.search(query, k)
+    elif len(allowed_ids) == 0:
+        return []
+    elif len(allowed_ids) <= EXACT_SEARCH_LIMIT:
+        return exact_search(index, query, k, allowed_ids)
+    else:
+        selector = faiss.IDSelectorBatch(np.asarray(allowed_ids, dtype="int64"))
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=max(64, 4 * k))
+        distances, labels = index.search(query, k, params=params)
+    return [
+        (int(label), float(distance))
+        for label, distance in zip(labels[0], distances[0])
+        if label != -1
+    ]
+
+
+def exact_search(index, query: np.ndarray, k: int, allowed_ids: List[int]) -> List[Tuple[int, float]]:
+    candidate_ids = []
+    vectors = []
+    for candidate_id in allowed_ids:
+        try:
+            vectors.append(index.reconstruct(int(candidate_id)))
+        except RuntimeError:
+            # Candidates added after the index was last built have no vector yet.
+            continue
+        candidate_ids.append(int(candidate_id))
+    if not vectors:
+        return []
+    distances = ((np.vstack(vectors) - query) ** 2).sum(axis=1)
+    nearest = np.argsort(distances)[:k]
+    return [(candidate_ids[i], float(distances[i])) for i in nearest]
+
+
+def fetch_candidate_documents(candidate_ids: List[int]) -> Dict[int, Dict]:
+    """Lazily loads summary text and metadata for the given candidates from SQLite."""
+    if not candidate_ids:
+        return {}
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    placeholders = ", ".join("?" for _ in candidate_ids)
+    cursor.execute(
+        f"""SELECT candidate_id, cv_summary, cv_filename, email_id FROM candidates WHERE candidate_id IN ({placeholders})""",
+        candidate_ids,
+    )
+    rows = cursor.fetchall()
+    conn.close()
+    return {
+        candidate_id: {
+            "cv_summary": cv_summary.strip(),
+            "cv_filename": cv_filename.strip(),
+            "email_id": email_id.strip(),
+        }
+        for candidate_id, cv_summary, cv_filename, email_id in rows
+    }
 
 
 if __name__ == "__main__":
-    create_vector_db()
\ No newline at end of file
+    create_vector_db()
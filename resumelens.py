@@ -0,0 +1,272 @@
+import time
+
+# Taken before anything else is imported, so startup timings include the interpreter's own imports.
+PROCESS_START = time.perf_counter()
+
+import os
+import json
+import secrets
+import logging
+import argparse
+import importlib
+import sys
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from dotenv import load_dotenv
+
+from pipeline import PHASES, run_phases
+
+load_dotenv()
+
+DAEMON_HOST = "127.0.0.1"
+DAEMON_PORT = int(os.getenv("RESUMELENS_DAEMON_PORT", "8765"))
+# Written by `serve` with the port and a random auth key; clients find the daemon through it.
+DAEMON_STATE_FILE = Path(os.getenv("RESUMELENS_DAEMON_FILE") or ".resumelens_daemon")
+# Settings the stage modules read once at import. The daemon records its values, and a client whose
+# environment differs runs locally, since the daemon would otherwise silently use its own values.
+DAEMON_SETTINGS = (
+    "DB_NAME",
+    "CV_BASE_DIRECTORY",
+    "VECTOR_DB_PATH",
+    "EMBEDDING_MODEL",
+    "EXPORT_DIRECTORY",
+    "GOVERNOR_DIRECTORY",
+    "PAGE_CACHE_DIRECTORY",
+    "OCR_REPROCESS",
+    "OCR_LANGUAGES",
+    "OCR_FORCE_FULL_PAGE",
+    "OCR_DPI",
+    "OCR_WORKERS",
+    "OCR_WORKER_MEMORY_MB",
+    "MIN_AVAILABLE_MEMORY_MB",
+    "MUST_HAVE_SKILL_COVERAGE",
+    "DUPLICATE_SIMILARITY",
+    "OLLAMA_NUM_CTX",
+    "OLLAMA_RESPONSE_RESERVE_TOKENS",
+    "OLLAMA_MAP_WORKERS",
+    "OLLAMA_NUM_THREAD",
+)
+
+# Modules each subcommand needs. Nothing heavy is imported until a subcommand is chosen, and the
+# time spent importing these is reported as part of that subcommand's startup. The other subcommands
+# are the phases of pipeline.py. job_data_extraction (pandas) is left out, since only `ingest --jobs` uses it.
+COMMAND_MODULES: Dict[str, List[str]] = {
+    "ingest": ["document_processing"],
+    **{
+        phase: ["model_scheduler", *(module_name for module_name, _, _ in stages)]
+        for phase, stages in PHASES.items()
+    },
+}
+
+# --- Logging Setup ---
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+def run_ingest(scheduler, options: dict) -> None:
+    import document_processing
+
+    # Job ingestion appends every row of the input sheet again, so it only runs when asked for.
+    if options.get("jobs"):
+        import job_data_extraction
+
+        job_data_extraction.main()
+    document_processing.main()
+
+
+def phase_command(phase: str) -> Callable:
+    def run_phase(scheduler, options: dict) -> None:
+        run_phases(scheduler, [phase])
+
+    return run_phase
+
+
+COMMANDS: Dict[str, Callable] = {
+    "ingest": run_ingest,
+    **{phase: phase_command(phase) for phase in PHASES},
+}
+
+
+def run_command(command: str, options: dict, scheduler, started: float) -> Dict[str, float]:
+    """Runs one subcommand in this process and returns its timings in seconds.
+
+    startup is everything between `started` (process start, or the daemon receiving the request)
+    and the stage starting its work; imports is the part of it spent importing the stage modules.
+    """
+    import_start = time.perf_counter()
+    for module_name in COMMAND_MODULES[command]:
+        importlib.import_module(module_name)
+    import_seconds = time.perf_counter() - import_start
+
+    # Parse statistics are per run; in the daemon they would otherwise accumulate across requests.
+    if "structured_output" in sys.modules:
+        sys.modules["structured_output"].parse_stats.clear()
+    run_start = time.perf_counter()
+    COMMANDS[command](scheduler, options)
+    timings = {
+        "startup": round(run_start - started, 3),
+        "imports": round(import_seconds, 3),
+        "run": round(time.perf_counter() - run_start, 3),
+    }
+    logger.info(
+        f"resumelens {command}: startup {timings['startup']:.2f}s "
+        f"(imports {timings['imports']:.2f}s), run {timings['run']:.2f}s"
+    )
+    return timings
+
+
+def read_daemon_state() -> Optional[dict]:
+    try:
+        return json.loads(DAEMON_STATE_FILE.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def current_settings() -> Dict[str, Optional[str]]:
+    return {name: os.getenv(name) for name in DAEMON_SETTINGS}
+
+
+def send_to_daemon(request: dict, check_settings: bool = True) -> Optional[dict]:
+    """Sends a request to a running daemon and returns its reply, or None when no daemon is reachable
+    or it was started with different settings than this process has.
+    """
+    state = read_daemon_state()
+    if state is None:
+        return None
+    if check_settings:
+        daemon_settings = state.get("settings") or {}
+        changed = [name for name, value in current_settings().items() if daemon_settings.get(name) != value]
+        if changed:
+            logger.warning(f"The daemon was started with different {', '.join(changed)}, running in this process")
+            return None
+    try:
+        with Client((DAEMON_HOST, state["port"]), authkey=bytes.fromhex(state["authkey"])) as connection:
+            connection.send(request)
+            return connection.recv()
+    except (OSError, EOFError, AuthenticationError):
+        logger.warning(f"No daemon answering on port {state['port']}, running in this process")
+        return None
+
+
+def preload() -> None:
+    """Imports every stage and loads the embedding model, so the first request is as fast as the rest."""
+    import_start = time.perf_counter()
+    for module_names in COMMAND_MODULES.values():
+        for module_name in module_names:
+            importlib.import_module(module_name)
+    import resume_vector_db
+
+    embedding_start = time.perf_counter()
+    resume_vector_db.get_embeddings()
+    logger.info(
+        f"Preloaded stage modules in {embedding_start - import_start:.2f}s "
+        f"and the embedding model in {time.perf_counter() - embedding_start:.2f}s"
+    )
+
+
+def serve(port: int) -> None:
+    """Long-running daemon: keeps modules, the embedding model and the Ollama models loaded between requests.
+
+    Requests are handled one at a time, since every stage writes to the same database.
+    """
+    from model_scheduler import ModelScheduler
+
+    scheduler = ModelScheduler(release_models=False)
+    preload()
+
+    authkey = secrets.token_bytes(32)
+    listener = Listener((DAEMON_HOST, port), authkey=authkey)
+    DAEMON_STATE_FILE.write_text(
+        json.dumps({"port": port, "authkey": authkey.hex(), "pid": os.getpid(), "settings": current_settings()})
+    )
+    DAEMON_STATE_FILE.chmod(0o600)
+    logger.info(f"resumelens daemon ready on {DAEMON_HOST}:{port} after {time.perf_counter() - PROCESS_START:.2f}s")
+
+    try:
+        while True:
+            try:
+                connection = listener.accept()
+                request = connection.recv()
+            except (OSError, EOFError, AuthenticationError) as e:
+                # Clients with a wrong auth key or that hang up early are dropped without a reply.
+                logger.warning(f"Dropped a daemon connection: {e}")
+                continue
+            with connection:
+                started = time.perf_counter()
+                command = request.get("command")
+                if command == "stop":
+                    connection.send({"ok": True})
+                    break
+                if command not in COMMANDS:
+                    connection.send({"ok": False, "error": f"Unknown command: {command}"})
+                    continue
+                try:
+                    timings = run_command(command, request.get("options") or {}, scheduler, started)
+                    connection.send({"ok": True, "timings": timings})
+                except Exception as e:
+                    logger.exception(f"resumelens {command} failed in the daemon")
+                    connection.send({"ok": False, "error": str(e)})
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        DAEMON_STATE_FILE.unlink(missing_ok=True)
+        scheduler.release_all()
+        scheduler.report()
+        logger.info("resumelens daemon stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="resumelens", description="Run ResumeLens pipeline stages.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="OCR new resume PDFs into the database")
+    ingest_parser.add_argument("--jobs", action="store_true", help="Also load the job listings sheet (appends every row)")
+    subparsers.add_parser("extract", help="Summaries, PII and attributes for jobs and resumes")
+    subparsers.add_parser("index", help="Rebuild the resume vector index")
+    subparsers.add_parser("match", help="Score candidates against every job")
+    subparsers.add_parser("email", help="Generate outreach emails")
+    serve_parser = subparsers.add_parser("serve", help="Run as a daemon that keeps models loaded between invocations")
+    serve_parser.add_argument("--port", type=int, default=DAEMON_PORT)
+    serve_parser.add_argument("--stop", action="store_true", help="Stop the running daemon")
+
+    for subparser in subparsers.choices.values():
+        if subparser is not serve_parser:
+            subparser.add_argument("--local", action="store_true", help="Run in this process even if a daemon is running")
+    args = parser.parse_args()
+    options = {key: value for key, value in vars(args).items() if key not in ("command", "local")}
+
+    if args.command == "serve":
+        if args.stop:
+            if send_to_daemon({"command": "stop"}, check_settings=False) is None:
+                logger.info("No daemon is running")
+            return
+        serve(args.port)
+        return
+
+    if not args.local:
+        reply = send_to_daemon({"command": args.command, "options": options})
+        if reply is not None:
+            if not reply["ok"]:
+                raise SystemExit(f"resumelens {args.command} failed in the daemon: {reply['error']}")
+            timings = reply["timings"]
+            logger.info(
+                f"resumelens {args.command} ran in the daemon: startup {timings['startup']:.2f}s "
+                f"(imports {timings['imports']:.2f}s), run {timings['run']:.2f}s, "
+                f"client {time.perf_counter() - PROCESS_START:.2f}s"
+            )
+            return
+
+    from model_scheduler import ModelScheduler
+
+    scheduler = ModelScheduler()
+    run_command(args.command, options, scheduler, PROCESS_START)
+    scheduler.report()
+
+
+if __name__ == "__main__":
+    main()
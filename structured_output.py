@@ -0,0 +1,172 @@
+import ast
+import json
+import re
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, Optional, Tuple, Type, TypeVar
+
+from ollama import ChatResponse, chat
+from pydantic import BaseModel, ValidationError
+
+from model_scheduler import keep_alive_for
+from prompt_budget import NUM_CTX
+from resource_governor import ollama_runner_options
+
+THINK_PATTERN = re.compile(r"<think>.*?</think>", re.DOTALL)
+CODE_FENCE_PATTERN = re.compile(r"```(?:json)?", re.IGNORECASE)
+TRAILING_COMMA_PATTERN = re.compile(r",\s*([}\]])")
+SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+
+# The original request is repeated, so the model answers the missing field from the source text
+# rather than inventing it from its previous answer alone.
+FIELD_PROMPT_TEMPLATE = """{prompt}
+
+Your previous answer to the request above did not contain a valid "{field}" field.
+Previous answer:
+{answer}
+Using only the request above, reply in json format with that single field:
+{{"{field}": <value>}}"""
+# Longer previous answers are cut in the re-ask prompt, which already carries the full request.
+MAX_ANSWER_CHARS = 2000
+
+SchemaT = TypeVar("SchemaT", bound=BaseModel)
+
+logger = logging.getLogger(__name__)
+
+# Per-model counters: requests, parsed (valid first time), repaired (fixed locally), retried (no JSON, asked again),
+# reasked, failed, prompt_tokens.
+parse_stats: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+# map_reduce calls generate_structured from several threads at once.
+parse_stats_lock = threading.Lock()
+
+
+def count_stat(model: str, name: str, amount: int = 1) -> None:
+    with parse_stats_lock:
+        parse_stats[model][name] += amount
+
+
+def strip_reasoning(text: str) -> str:
+    """Drops <think> blocks emitted by reasoning models, including an unterminated opening one."""
+    text = THINK_PATTERN.sub("", text or "")
+    if "</think>" in text:
+        text = text.split("</think>", 1)[1]
+    return text.strip()
+
+
+def parse_json_object(text: str) -> Tuple[Optional[dict], bool]:
+    """Parses a JSON object out of a model answer. Returns (object or None, whether it needed repair)."""
+    try:
+        data = json.loads(text)
+        if isinstance(data, dict):
+            return data, False
+    except json.JSONDecodeError:
+        pass
+
+    candidate = CODE_FENCE_PATTERN.sub("", text).translate(SMART_QUOTES)
+    start, end = candidate.find("{"), candidate.rfind("}")
+    if start == -1 or end <= start:
+        return None, True
+    candidate = TRAILING_COMMA_PATTERN.sub(r"\1", candidate[start : end + 1])
+    try:
+        data = json.loads(candidate)
+    except json.JSONDecodeError:
+        try:
+            # Single-quoted keys and Python literals (True/None) are a common near miss.
+            data = ast.literal_eval(candidate)
+        except (ValueError, SyntaxError):
+            return None, True
+    return (data, True) if isinstance(data, dict) else (None, True)
+
+
+def request_json(model: str, prompt: str, json_schema: dict, options: dict) -> str:
+    message = {"role": "user", "content": prompt}
+    response: ChatResponse = chat(
+        model=model,
+        messages=[message],
+        format=json_schema,
+        options={**options, "num_ctx": NUM_CTX, **ollama_runner_options()},
+        keep_alive=keep_alive_for(model),
+    )
+    count_stat(model, "prompt_tokens", response.prompt_eval_count or 0)
+    return strip_reasoning(response.message.content)
+
+
+def invalid_fields(schema: Type[BaseModel], data: dict) -> Optional[list]:
+    try:
+        schema.model_validate(data)
+        return None
+    except ValidationError as e:
+        return sorted({str(error["loc"][0]) for error in e.errors() if error["loc"]})
+
+
+def generate_structured(
+    model: str, prompt: str, schema: Type[SchemaT], options: dict, record_id=None
+) -> Optional[SchemaT]:
+    """Asks the model for output matching schema, using Ollama's format mode.
+
+    Answers that do not parse are repaired locally. When no JSON object can be recovered at all the
+    request is repeated once; fields that are still missing or invalid are re-asked one at a time,
+    together with the original prompt, instead of regenerating the whole answer.
+    Returns None when the answer cannot be made valid.
+    """
+    count_stat(model, "requests")
+    json_schema = schema.model_json_schema()
+
+    answer = request_json(model, prompt, json_schema, options)
+    data, repaired = parse_json_object(answer)
+    if data is None:
+        logger.warning(f"No JSON object in the answer from {model} for ID: {record_id}, asking again")
+        count_stat(model, "retried")
+        answer = request_json(model, prompt, json_schema, options)
+        data, repaired = parse_json_object(answer)
+        if data is None:
+            count_stat(model, "failed")
+            logger.error(f"Failed to get valid output from {model} for ID: {record_id}: {answer}")
+            return None
+
+    fields = invalid_fields(schema, data)
+    if fields is None:
+        count_stat(model, "repaired" if repaired else "parsed")
+        return schema.model_validate(data)
+
+    logger.warning(f"Invalid fields {fields} from {model} for ID: {record_id}, re-asking for them")
+    for field in fields:
+        if field not in json_schema.get("properties", {}):
+            continue
+        field_schema = {
+            "type": "object",
+            "properties": {field: json_schema["properties"][field]},
+            "required": [field],
+        }
+        if "$defs" in json_schema:
+            field_schema["$defs"] = json_schema["$defs"]
+        field_answer = request_json(
+            model,
+            FIELD_PROMPT_TEMPLATE.format(prompt=prompt, field=field, answer=answer[:MAX_ANSWER_CHARS]),
+            field_schema,
+            options,
+        )
+        field_data, _ = parse_json_object(field_answer)
+        if field_data and field in field_data:
+            data[field] = field_data[field]
+
+    if invalid_fields(schema, data) is None:
+        count_stat(model, "reasked")
+        return schema.model_validate(data)
+
+    count_stat(model, "failed")
+    logger.error(f"Failed to get valid output from {model} for ID: {record_id}: {answer}")
+    return None
+
+
+def log_parse_report() -> None:
+    for model, stats in parse_stats.items():
+        requests = stats["requests"] or 1
+        logger.info(
+            f"Structured output for {model}: {stats['requests']} requests, "
+            f"{stats['parsed']} valid first time, {stats['repaired']} repaired locally, "
+            f"{stats['retried']} asked again for lack of JSON, "
+            f"{stats['reasked']} fixed by re-asking, {stats['failed']} failed "
+            f"({100 * stats['failed'] / requests:.1f}% failure rate), {stats['prompt_tokens']} prompt tokens"
+        )